@@ -1,17 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, send_file, has_request_context, g, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, LoginManager, login_user, logout_user, login_required, current_user
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
-from werkzeug.utils import secure_filename
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.exceptions import RequestEntityTooLarge, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import func, event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, object_session
+from sqlalchemy.orm.attributes import flag_modified
 from os import environ
 import random
 import threading
+import queue
+import collections
+import heapq
+import functools
+import tempfile
+import hashlib
+import hmac
+import logging
+import logging.handlers
+import shutil
+import contextlib
+import mimetypes
+import sqlite3
+import gzip
+import zlib
+import click
+from xml.sax.saxutils import escape as xml_escape
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import smtplib
 from email.mime.text import MIMEText
@@ -25,6 +49,16 @@ import requests
 from pytrends.request import TrendReq
 import subprocess
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from jinja2 import FileSystemBytecodeCache
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 app = Flask(__name__)
@@ -36,7 +70,8 @@ CORS(app, origins=["http://localhost:3000", "http://localhost:5000", "http://127
 app.config['SECRET_KEY'] = 'antlers-secret-key-2003'
 
 # Configure database
-instance_path = os.path.join(app.root_path, 'instance')
+instance_path = os.getenv('INSTANCE_PATH', os.path.join(app.root_path, 'instance'))
+app.instance_path = instance_path
 if not os.path.exists(instance_path):
     os.makedirs(instance_path)
 db_path = os.path.join(instance_path, 'antlers.db')
@@ -48,10 +83,18 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Compiled templates are shared between workers and survive restarts
+JINJA_CACHE_FOLDER = os.path.join(instance_path, 'jinja_cache')
+os.makedirs(JINJA_CACHE_FOLDER, exist_ok=True)
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(JINJA_CACHE_FOLDER)}
+
 # Configure upload folder for images
 UPLOAD_FOLDER = 'static/uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Per-file limits are enforced while streaming; this caps the whole request
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+MAX_UPLOAD_PIXELS = int(os.getenv('MAX_UPLOAD_PIXELS', str(40_000_000)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
@@ -63,13 +106,17 @@ login_manager.login_view = 'login'
 load_dotenv()
 import os
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # The navbar's unread badge is loaded with the user instead of by its own query
+    unread = db.select(func.coalesce(func.sum(UnreadCounter.count), 0)).where(
+        UnreadCounter.user_id == User.id
+    ).scalar_subquery()
+    row = db.session.query(User, unread).filter(User.id == int(user_id)).first()
+    if row is None:
+        return None
+    user, g.unread_message_count = row
+    return user
 
 # Import models after db initialization
 class User(db.Model, UserMixin):
@@ -106,6 +153,7 @@ class PendingAccessory(db.Model):
     category = db.Column(db.String(50))
     location = db.Column(db.String(150))
     image = db.Column(db.String(150))
+    image_renditions = db.Column(db.Text)  # JSON written by the image pool
     type = db.Column(db.String(50))  # 'lend' or 'donate'
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     datetime = db.Column(db.DateTime, default=func.now())
@@ -122,11 +170,14 @@ class Accessory(db.Model):
     category = db.Column(db.String(50))
     location = db.Column(db.String(150))
     image = db.Column(db.String(150))
+    image_renditions = db.Column(db.Text)  # JSON written by the image pool
     is_available = db.Column(db.Boolean, default=True)
     type = db.Column(db.String(50))  # 'lend' or 'donate'
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
     slug = db.Column(db.String(200), unique=True, nullable=True)
+    json_ld = db.Column(db.Text)  # Built on write, embedded by item_detail.html
 
 class BorrowedAccessory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -208,6 +259,7 @@ class RejectedAccessory(db.Model):
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     image = db.Column(db.String(255))
+    image_renditions = db.Column(db.Text)  # JSON written by the image pool
     location = db.Column(db.String(100), nullable=False)
     residence = db.Column(db.String(200), nullable=False)
     datetime = db.Column(db.DateTime, nullable=False)
@@ -227,6 +279,8 @@ class ChatMessage(db.Model):
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=func.now())
     is_read = db.Column(db.Boolean, default=False)
+    # Load the database timestamp with the INSERT so after_insert events can send it
+    __mapper_args__ = {'eager_defaults': True}
 
     # Relationships
     borrow_request = db.relationship('BorrowedAccessory', backref=db.backref('chat_messages', lazy=True, order_by='ChatMessage.timestamp'))
@@ -238,6 +292,7 @@ class CommunityChatMessage(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=func.now())
+    __mapper_args__ = {'eager_defaults': True}
     
     # Relationships
     user = db.relationship('User', backref=db.backref('community_messages', lazy=True))
@@ -249,6 +304,7 @@ class SwapItem(db.Model):
     category = db.Column(db.String(50), nullable=False)
     condition = db.Column(db.String(20), nullable=False)
     image = db.Column(db.String(255), nullable=False)
+    image_renditions = db.Column(db.Text)  # JSON written by the image pool
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected, completed
     created_at = db.Column(db.DateTime, default=func.now())
@@ -286,6 +342,13 @@ swap_event_items = db.Table('swap_event_items',
     db.Column('item_id', db.Integer, db.ForeignKey('swap_item.id'), primary_key=True)
 )
 
+# Who took part in which event, derived from swap_event_items and the items'
+# owner/recipient; see refresh_swap_participation()
+class SwapParticipation(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('swap_event.id'), primary_key=True, index=True)
+    role = db.Column(db.String(20), primary_key=True)  # 'owner' or 'recipient'
+
 class GameChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     swap_item_id = db.Column(db.Integer, db.ForeignKey('swap_item.id'), nullable=False)
@@ -306,6 +369,7 @@ class GameCommunityMessage(db.Model):
     swap_event_id = db.Column(db.Integer, db.ForeignKey('swap_event.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=func.now())
+    __mapper_args__ = {'eager_defaults': True}
     
     # Relationships
     user = db.relationship('User', backref=db.backref('game_community_messages', lazy=True))
@@ -318,6 +382,7 @@ class ContactMessage(db.Model):
     subject = db.Column(db.String(200), nullable=False)
     message = db.Column(db.Text, nullable=False)
     image = db.Column(db.String(255))  # Optional image path
+    image_renditions = db.Column(db.Text)  # JSON written by the image pool
     created_at = db.Column(db.DateTime, default=func.now())
 
 class BlogPost(db.Model):
@@ -333,14 +398,582 @@ class BlogPost(db.Model):
     status = db.Column(db.String(20), default='draft')  # 'draft', 'approved'
     source_links = db.Column(db.Text)  # JSON or comma-separated links
     ai_generated = db.Column(db.Boolean, default=True)
+    json_ld = db.Column(db.Text)  # Built on write, embedded by blog_post.html
 
     @validates('slug')
     def convert_slug(self, key, value):
         return value.lower().replace(' ', '-')
 
+# Unread messages per (user, thread), kept up to date as messages are inserted
+# and reset when the thread is opened, so badges never need a COUNT.
+class UnreadCounter(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    thread_type = db.Column(db.String(20), primary_key=True)  # 'borrow' or 'swap'
+    thread_id = db.Column(db.Integer, primary_key=True)  # borrowed_accessory.id or swap_item.id
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class JobRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False, index=True)  # e.g. 'ai_blog_generation'
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    progress = db.Column(db.Text)  # JSON: {step: {'status': ..., 'error': ...}}
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # At most one queued or running run per kind; enqueue_job() relies on it
+    __table_args__ = (
+        db.Index('ix_job_run_one_in_flight', 'kind', unique=True,
+                 postgresql_where=text("status IN ('queued', 'running')"),
+                 sqlite_where=text("status IN ('queued', 'running')")),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': json.loads(self.progress) if self.progress else {},
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+# Real-time event broker used by the chat streams.
+# InMemoryBroker fans events out to subscribers inside one worker process. The
+# Postgres and SQLite brokers relay published events between worker processes
+# and then hand them to the same in-process fan-out.
+class InMemoryBroker:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._listeners = {}
+
+    def _start(self):
+        pass
+
+    def subscribe(self, channel):
+        self._start()
+        subscription = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def add_listener(self, channel, callback):
+        """Call callback(event) for every event on channel, from whichever
+        thread delivers it. Used to keep per-worker caches in sync."""
+        self._start()
+        with self._lock:
+            self._listeners.setdefault(channel, []).append(callback)
+
+    def remove_listener(self, channel, callback):
+        with self._lock:
+            listeners = self._listeners.get(channel)
+            if listeners and callback in listeners:
+                listeners.remove(callback)
+                if not listeners:
+                    del self._listeners[channel]
+
+    def publish(self, channel, event):
+        self._dispatch(channel, event)
+
+    def _dispatch(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+            listeners = list(self._listeners.get(channel, ()))
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                app.logger.error(f"Event listener for {channel} failed: {str(e)}")
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # A stalled client must not block the publisher; it will
+                # catch up from the database on reconnect via Last-Event-ID.
+                pass
+
+class PostgresBroker(InMemoryBroker):
+    """Relays events between workers with Postgres LISTEN/NOTIFY."""
+    pg_channel = 'antlers_events'
+    # NOTIFY payloads are capped at 8000 bytes by Postgres
+    max_payload = 7900
+
+    def __init__(self, queue_size=100):
+        super().__init__(queue_size)
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, channel, event):
+        payload = json.dumps({'channel': channel, 'event': event})
+        if len(payload.encode('utf-8')) > self.max_payload:
+            event = dict(event, message=None, truncated=True)
+            payload = json.dumps({'channel': channel, 'event': event})
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                                   {'channel': self.pg_channel, 'payload': payload})
+                connection.commit()
+        except Exception as e:
+            app.logger.error(f"Failed to publish event on {channel}: {str(e)}")
+            # Still deliver to subscribers connected to this worker
+            self._dispatch(channel, event)
+
+    def _complete(self, channel, event):
+        """Reload the text publish() dropped from a chat or room message, or
+        return None to skip it when the message no longer exists."""
+        if not event.get('truncated'):
+            return event
+        try:
+            with app.app_context():
+                if channel.startswith('chat:'):
+                    chat_message = db.session.get(ChatMessage, event['id'])
+                    return chat_message_event(chat_message) if chat_message else None
+                model = CommunityChatMessage if channel == COMMUNITY_ROOM else GameCommunityMessage
+                row = db.session.get(model, event['id'])
+                return room_row_event(channel, row) if row else None
+        except Exception as e:
+            app.logger.error(f"Failed to reload truncated event on {channel}: {str(e)}")
+            return None
+
+    def _start(self):
+        # Started lazily so each gunicorn worker gets its own listener after fork
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='pg-event-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        import select
+        while True:
+            try:
+                connection = db.engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.pg_channel}')
+                while True:
+                    if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        data = json.loads(notify.payload)
+                        event = self._complete(data['channel'], data['event'])
+                        if event is not None:
+                            self._dispatch(data['channel'], event)
+            except Exception as e:
+                app.logger.error(f"Postgres event listener error: {str(e)}")
+                time.sleep(5)
+
+class SQLiteBroker(InMemoryBroker):
+    """Local stand-in for PostgresBroker: relays events between workers on
+    one machine through a shared SQLite file that every worker polls."""
+
+    def __init__(self, path, queue_size=100, poll_interval=0.5, retention_seconds=300):
+        super().__init__(queue_size)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._poller = None
+        self._poller_lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS events ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)')
+
+    def _connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=10)
+
+    def publish(self, channel, event):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('INSERT INTO events (channel, payload, created) VALUES (?, ?, ?)',
+                               (channel, json.dumps(event), now))
+            connection.execute('DELETE FROM events WHERE created < ?', (now - self.retention_seconds,))
+
+    def _start(self):
+        with self._poller_lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, name='sqlite-event-poller', daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        with self._connect() as connection:
+            last_id = connection.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        while True:
+            try:
+                with self._connect() as connection:
+                    rows = connection.execute('SELECT id, channel, payload FROM events WHERE id > ? ORDER BY id',
+                                              (last_id,)).fetchall()
+                for event_id, channel, payload in rows:
+                    last_id = event_id
+                    self._dispatch(channel, json.loads(payload))
+            except Exception as e:
+                app.logger.error(f"SQLite event poller error: {str(e)}")
+            time.sleep(self.poll_interval)
+
+def create_event_broker():
+    backend = os.getenv('EVENT_BROKER', 'auto')
+    if backend == 'auto':
+        backend = 'postgres' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql') else 'memory'
+    if backend == 'postgres':
+        return PostgresBroker()
+    if backend == 'sqlite':
+        return SQLiteBroker(os.path.join(instance_path, 'events.db'))
+    return InMemoryBroker()
+
+event_broker = create_event_broker()
+
+def chat_event(message_id, borrow_id, sender_id, recipient_id, message, timestamp):
+    return {
+        'id': message_id,
+        'borrow_id': borrow_id,
+        'sender_id': sender_id,
+        'recipient_id': recipient_id,
+        'message': message,
+        'timestamp': timestamp.isoformat() if timestamp else None
+    }
+
+def chat_message_event(chat_message):
+    return chat_event(chat_message.id, chat_message.borrow_id, chat_message.sender_id,
+                      chat_message.recipient_id, chat_message.message, chat_message.timestamp)
+
+# Events are queued on the session at insert time and only published once the
+# transaction commits, so subscribers never see messages that were rolled back.
+def queue_event(target, channel, payload):
+    session = object_session(target)
+    if session is not None:
+        queue_session_event(session, channel, payload)
+
+def queue_session_event(session, channel, payload):
+    session.info.setdefault('pending_events', []).append((channel, payload))
+
+def increment_unread(connection, user_id, thread_type, thread_id):
+    table = UnreadCounter.__table__
+    values = {'user_id': user_id, 'thread_type': thread_type, 'thread_id': thread_id, 'count': 1}
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        upsert = None
+    if upsert is not None:
+        connection.execute(upsert(table).values(**values).on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.thread_type, table.c.thread_id],
+            set_={'count': table.c.count + 1}))
+        return
+    result = connection.execute(table.update().where(
+        table.c.user_id == user_id, table.c.thread_type == thread_type, table.c.thread_id == thread_id
+    ).values(count=table.c.count + 1))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+@event.listens_for(ChatMessage, 'after_insert')
+def queue_chat_message_event(mapper, connection, target):
+    increment_unread(connection, target.recipient_id, 'borrow', target.borrow_id)
+    queue_event(target, f'chat:{target.borrow_id}', chat_message_event(target))
+
+@event.listens_for(GameChatMessage, 'after_insert')
+def count_game_chat_message(mapper, connection, target):
+    increment_unread(connection, target.recipient_id, 'swap', target.swap_item_id)
+
+def mark_thread_read(user_id, thread_type, thread_id):
+    """Flip is_read on every message the user has received in a thread with
+    one UPDATE, and reset the thread's unread counter. Skipped entirely when
+    the counter says there is nothing to mark."""
+    counter = db.session.get(UnreadCounter, (user_id, thread_type, thread_id))
+    if not counter or not counter.count:
+        return 0
+    if thread_type == 'borrow':
+        model, thread_column = ChatMessage, ChatMessage.borrow_id
+    else:
+        model, thread_column = GameChatMessage, GameChatMessage.swap_item_id
+    marked = model.query.filter(
+        thread_column == thread_id,
+        model.recipient_id == user_id,
+        model.is_read == False
+    ).update({'is_read': True}, synchronize_session=False)
+    if 'unread_message_count' in g:
+        g.unread_message_count -= counter.count
+    counter.count = 0
+    if thread_type == 'borrow':
+        # Read receipt for the other participant's open chat stream
+        queue_session_event(db.session(), f'chat:{thread_id}', {'type': 'read', 'reader_id': user_id})
+    db.session.commit()
+    return marked
+
+def delete_unread_counters(connection, thread_type, thread_ids):
+    table = UnreadCounter.__table__
+    connection.execute(table.delete().where(table.c.thread_type == thread_type, table.c.thread_id.in_(thread_ids)))
+
+@event.listens_for(BorrowedAccessory, 'after_delete')
+def delete_borrow_unread_counters(mapper, connection, target):
+    delete_unread_counters(connection, 'borrow', [target.id])
+
+@event.listens_for(SwapItem, 'after_delete')
+def delete_swap_unread_counters(mapper, connection, target):
+    delete_unread_counters(connection, 'swap', [target.id])
+
+def unread_counts(user_id, thread_type):
+    return dict(db.session.query(UnreadCounter.thread_id, UnreadCounter.count).filter(
+        UnreadCounter.user_id == user_id,
+        UnreadCounter.thread_type == thread_type,
+        UnreadCounter.count > 0
+    ).all())
+
+@app.context_processor
+def inject_unread_message_count():
+    if not current_user.is_authenticated:
+        return {}
+    return {'unread_message_count': g.get('unread_message_count', 0)}
+
+@event.listens_for(db.session, 'after_commit')
+def publish_pending_events(session):
+    for channel, payload in session.info.pop('pending_events', []):
+        event_broker.publish(channel, payload)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_pending_events(session, previous_transaction):
+    session.info.pop('pending_events', None)
+
+# Room feeds for the community chat and the per-event swap chats.
+# Each worker keeps the last ROOM_HISTORY_SIZE messages of a room in a ring
+# buffer, loaded from the database once and then kept current by the broker,
+# so page views and long-polls for hot rooms are served from memory.
+ROOM_HISTORY_SIZE = 50
+MAX_ROOM_FEEDS = 200
+COMMUNITY_ROOM = 'community'
+
+def event_room(event_id):
+    return f'event:{event_id}'
+
+class RoomMessage:
+    """Read-only stand-in for a chat row, rendered by the room templates."""
+    def __init__(self, data):
+        self.id = data['id']
+        self.user_id = data['user_id']
+        self.message = data['message']
+        self.timestamp = datetime.fromisoformat(data['timestamp']) if data['timestamp'] else None
+        self.user = RoomUser(data['user_id'], data['username'])
+
+class RoomUser:
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+class RoomFeed:
+    def __init__(self, room, size=ROOM_HISTORY_SIZE):
+        self.room = room
+        self.messages = collections.deque(maxlen=size)
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        with self._lock:
+            # Events that arrived while the rows were being read are kept
+            merged = {m['id']: m for m in rows}
+            merged.update((m['id'], m) for m in self.messages)
+            self.messages.clear()
+            self.messages.extend(sorted(merged.values(), key=lambda m: m['id'])[-self.messages.maxlen:])
+            self.loaded = True
+
+    def apply(self, event_data):
+        with self._lock:
+            if event_data.get('type') == 'delete':
+                remaining = [m for m in self.messages if m['id'] != event_data['id']]
+                self.messages.clear()
+                self.messages.extend(remaining)
+            elif event_data.get('type') == 'message' and event_data.get('truncated'):
+                # The broker dropped the text to fit NOTIFY; reload the room
+                # from the database on next use instead of keeping a blank
+                self.loaded = False
+            elif event_data.get('type') == 'message':
+                if self.messages and self.messages[-1]['id'] >= event_data['id']:
+                    if any(m['id'] == event_data['id'] for m in self.messages):
+                        return
+                    ordered = sorted(list(self.messages) + [event_data], key=lambda m: m['id'])
+                    self.messages.clear()
+                    self.messages.extend(ordered[-self.messages.maxlen:])
+                else:
+                    self.messages.append(event_data)
+
+    def since(self, last_id=0):
+        with self._lock:
+            return [m for m in self.messages if m['id'] > last_id]
+
+room_feeds = collections.OrderedDict()
+room_feeds_lock = threading.Lock()
+
+def room_message_event(room, message_id, user_id, username, message, timestamp):
+    return {
+        'type': 'message',
+        'room': room,
+        'id': message_id,
+        'user_id': user_id,
+        'username': username,
+        'message': message,
+        'timestamp': timestamp.isoformat() if timestamp else None
+    }
+
+def room_row_event(room, row):
+    return room_message_event(room, row.id, row.user_id, row.user.username if row.user else None,
+                              row.message, row.timestamp)
+
+def load_room_rows(room):
+    if room == COMMUNITY_ROOM:
+        model = CommunityChatMessage
+        query = CommunityChatMessage.query
+    else:
+        model = GameCommunityMessage
+        query = GameCommunityMessage.query.filter_by(swap_event_id=int(room.split(':', 1)[1]))
+    rows = query.options(joinedload(model.user)).order_by(model.id.desc()).limit(ROOM_HISTORY_SIZE).all()
+    return [room_row_event(room, m) for m in reversed(rows)]
+
+def get_room_feed(room):
+    with room_feeds_lock:
+        feed = room_feeds.get(room)
+        if feed is not None:
+            room_feeds.move_to_end(room)
+        else:
+            feed = RoomFeed(room)
+            room_feeds[room] = feed
+            event_broker.add_listener(room, feed.apply)
+            if len(room_feeds) > MAX_ROOM_FEEDS:
+                evicted_room, evicted = room_feeds.popitem(last=False)
+                event_broker.remove_listener(evicted_room, evicted.apply)
+    if not feed.loaded:
+        feed.load(load_room_rows(room))
+    return feed
+
+def username_for(connection, target):
+    user = target.__dict__.get('user')
+    if user is not None:
+        return user.username
+    return connection.execute(db.select(User.username).where(User.id == target.user_id)).scalar()
+
+@event.listens_for(CommunityChatMessage, 'after_insert')
+def queue_community_message_event(mapper, connection, target):
+    queue_event(target, COMMUNITY_ROOM, room_message_event(
+        COMMUNITY_ROOM, target.id, target.user_id, username_for(connection, target),
+        target.message, target.timestamp))
+
+@event.listens_for(CommunityChatMessage, 'after_delete')
+def queue_community_delete_event(mapper, connection, target):
+    queue_event(target, COMMUNITY_ROOM, {'type': 'delete', 'room': COMMUNITY_ROOM, 'id': target.id})
+
+@event.listens_for(GameCommunityMessage, 'after_insert')
+def queue_game_community_message_event(mapper, connection, target):
+    room = event_room(target.swap_event_id)
+    queue_event(target, room, room_message_event(
+        room, target.id, target.user_id, username_for(connection, target),
+        target.message, target.timestamp))
+
+@event.listens_for(GameCommunityMessage, 'after_delete')
+def queue_game_community_delete_event(mapper, connection, target):
+    room = event_room(target.swap_event_id)
+    queue_event(target, room, {'type': 'delete', 'room': room, 'id': target.id})
+
 # Function to create tables and the admin user
+def backfill_unread_counters():
+    """Seed unread_counter from the message tables the first time it exists."""
+    if UnreadCounter.query.first():
+        return
+    table = UnreadCounter.__table__
+    for thread_type, model, thread_column in (('borrow', ChatMessage, ChatMessage.borrow_id),
+                                              ('swap', GameChatMessage, GameChatMessage.swap_item_id)):
+        unread = db.select(model.recipient_id, db.literal(thread_type), thread_column, func.count()).where(
+            model.is_read == False
+        ).group_by(model.recipient_id, thread_column)
+        db.session.execute(table.insert().from_select(['user_id', 'thread_type', 'thread_id', 'count'], unread))
+    db.session.commit()
+
+def backfill_swap_participation():
+    """Seed swap_participation from existing events the first time it exists."""
+    if SwapParticipation.query.first() or not db.session.query(swap_event_items).first():
+        return
+    refresh_swap_participation()
+    db.session.commit()
+
+def add_missing_columns():
+    """db.create_all() never alters existing tables, so add any nullable
+    columns that were introduced after a table was first created."""
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            quote = db.engine.dialect.identifier_preparer.quote
+            db.session.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}'))
+            app.logger.info(f"Added column {table.name}.{column.name}")
+    db.session.commit()
+
+def add_missing_indexes():
+    """Likewise for indexes declared after their table was created."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                app.logger.error(f"Could not create index {index.name}: {str(e)}")
+
+STARTUP_LOCK_KEY = 7254002
+
+@contextlib.contextmanager
+def startup_lock():
+    """Let one booting worker at a time create tables, add columns and run
+    backfills; the others wait and then find the work already done."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': STARTUP_LOCK_KEY})
+            connection.commit()
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': STARTUP_LOCK_KEY})
+                connection.commit()
+    else:
+        import fcntl
+        with open(os.path.join(instance_path, 'startup.lock'), 'w') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
 def create_tables_and_admin():
+    with startup_lock():
+        setup_database()
+
+def setup_database():
     db.create_all()  
+    add_missing_columns()
+    add_missing_indexes()
+    backfill_unread_counters()
+    backfill_json_ld()
+    backfill_swap_participation()
     from datetime import datetime, timedelta
     admin = None
     user = None
@@ -367,6 +1000,534 @@ def create_tables_and_admin():
 
 
 
+# Rate limiting.
+# Endpoints that send mail, process images or call paid APIs are wrapped in
+# @rate_limit(capacity, per): each caller (the logged-in user, otherwise the
+# client IP) gets a token bucket holding `capacity` tokens that refills over
+# `per` seconds, and every counted request takes one. An empty bucket answers
+# 429 with Retry-After. Buckets live in instance/rate_limits.db so all
+# workers on the node share them (RATE_LIMIT_STORE=sqlite), in the worker's
+# memory (memory), or limiting is switched off (off). Rejections are counted
+# per endpoint and shown at /admin/rate-limits.
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'sqlite')
+RATE_LIMIT_PATH = os.path.join(instance_path, 'rate_limits.db')
+# Proxies in front of the app whose X-Forwarded-For can be trusted for the client IP
+PROXY_HOPS = int(os.getenv('PROXY_HOPS', '1' if environ.get('RENDER') else '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# endpoint -> (capacity, per seconds), filled in by @rate_limit
+RATE_LIMITS = {}
+
+class MemoryRateLimitStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        # (full_at, key) for every write; a bucket that has refilled is the
+        # same as no bucket, so those are dropped as their time comes
+        self.expiry = []
+        self.rejected = collections.Counter()
+
+    def take(self, key, capacity, rate, now):
+        """Take a token from key's bucket; returns the tokens left"""
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now:
+                full_at, old_key = heapq.heappop(self.expiry)
+                bucket = self.buckets.get(old_key)
+                if bucket is not None and bucket[2] == full_at:
+                    del self.buckets[old_key]
+            tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate) - 1
+            if tokens >= 0:
+                full_at = now + (capacity - tokens) / rate
+                self.buckets[key] = (tokens, now, full_at)
+                heapq.heappush(self.expiry, (full_at, key))
+            return tokens
+
+    def reject(self, name):
+        with self.lock:
+            self.rejected[name] += 1
+
+    def rejections(self):
+        with self.lock:
+            return dict(self.rejected)
+
+class SQLiteRateLimitStore:
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit_bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                         'updated REAL NOT NULL, full_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS rate_limit_bucket_full_at ON rate_limit_bucket (full_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit_rejection (name TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+
+    def _connect(self):
+        return contextlib.closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def take(self, key, capacity, rate, now):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM rate_limit_bucket WHERE key = ?', (key,)).fetchone()
+                tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+                tokens -= 1
+                if tokens >= 0:
+                    conn.execute('INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                                 (key, tokens, now, now + (capacity - tokens) / rate))
+                if random.random() < 0.01:
+                    conn.execute('DELETE FROM rate_limit_bucket WHERE full_at <= ?', (now,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return tokens
+
+    def reject(self, name):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO rate_limit_rejection (name, count) VALUES (?, 1) '
+                         'ON CONFLICT (name) DO UPDATE SET count = count + 1', (name,))
+
+    def rejections(self):
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT name, count FROM rate_limit_rejection'))
+
+def create_rate_limit_store():
+    if RATE_LIMIT_STORE == 'off':
+        return None
+    if RATE_LIMIT_STORE == 'memory':
+        return MemoryRateLimitStore()
+    return SQLiteRateLimitStore(RATE_LIMIT_PATH)
+
+rate_limit_store = create_rate_limit_store()
+
+def rate_limit_identity():
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    return f'ip:{request.remote_addr}'
+
+def rate_limit(capacity, per, methods=('POST',), when=None):
+    """Allow each user or IP `capacity` calls per `per` seconds to the wrapped
+    view, counting only `methods` requests for which `when()` is true."""
+    rate = capacity / per
+
+    def decorator(view):
+        RATE_LIMITS[view.__name__] = (capacity, per)
+
+        @functools.wraps(view)
+        def limited(*args, **kwargs):
+            if rate_limit_store is None or request.method not in methods or (when and not when()):
+                return view(*args, **kwargs)
+            name = request.endpoint
+            try:
+                tokens = rate_limit_store.take(f'{name}:{rate_limit_identity()}', capacity, rate, time.time())
+                if tokens < 0:
+                    rate_limit_store.reject(name)
+            except Exception as e:
+                # Never turn a broken limiter into an outage
+                app.logger.error(f"Rate limiter error: {str(e)}")
+                return view(*args, **kwargs)
+            if tokens >= 0:
+                return view(*args, **kwargs)
+            retry_after = max(1, int(-tokens / rate + 0.999))
+            if wants_json_response():
+                response = jsonify({'error': 'Too many requests. Please try again later.', 'retry_after': retry_after})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            raise TooManyRequests(f'Too many requests. Please try again in {retry_after} seconds.', retry_after=retry_after)
+        return limited
+    return decorator
+
+@app.route('/admin/rate-limits')
+@login_required
+def admin_rate_limits():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied.'}), 403
+    rejected = rate_limit_store.rejections() if rate_limit_store else {}
+    return jsonify({
+        'store': RATE_LIMIT_STORE,
+        'limits': {name: {'capacity': capacity, 'per_seconds': per, 'rejected': rejected.get(name, 0)}
+                   for name, (capacity, per) in RATE_LIMITS.items()},
+    })
+
+# Metrics.
+# Request latency and status, SQL statements, template rendering and email
+# sends are recorded in this process and exposed in the Prometheus text
+# format at /metrics, for admins or for scrapers presenting
+# `Authorization: Bearer $METRICS_TOKEN`. Values are per worker process;
+# Prometheus tells workers apart by instance. Request latency stops when the
+# view returns, so streamed bodies are not included.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(labels)} {value:g}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [count per bucket..., sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{self.name}_bucket{format_labels(labels + (("le", "+Inf"),))} {series[-1]}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} {series[-2]:g}')
+                lines.append(f'{self.name}_count{format_labels(labels)} {series[-1]}')
+        return lines
+
+HTTP_REQUESTS = Counter('antlers_http_requests_total', 'HTTP requests by endpoint, method and status.')
+HTTP_LATENCY = Histogram('antlers_http_request_duration_seconds', 'Time spent handling a request, by endpoint.')
+SQL_QUERIES = Counter('antlers_sql_queries_total', 'SQL statements executed, by endpoint.')
+SQL_SECONDS = Counter('antlers_sql_duration_seconds_total', 'Time spent executing SQL statements, by endpoint.')
+REQUEST_QUERIES = Histogram('antlers_http_request_sql_queries', 'SQL statements executed per request, by endpoint.',
+                            QUERY_COUNT_BUCKETS)
+TEMPLATE_LATENCY = Histogram('antlers_template_render_duration_seconds', 'Time spent rendering a template.')
+EMAIL_LATENCY = Histogram('antlers_email_send_duration_seconds', 'Time spent sending one email or batch, by kind.')
+EMAILS_SENT = Counter('antlers_emails_total', 'Emails handed to SMTP, by kind and result.')
+METRICS = (HTTP_REQUESTS, HTTP_LATENCY, SQL_QUERIES, SQL_SECONDS, REQUEST_QUERIES,
+           TEMPLATE_LATENCY, EMAIL_LATENCY, EMAILS_SENT)
+
+def metrics_endpoint():
+    """Label for work done outside of a request, e.g. jobs and mail threads"""
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+@contextlib.contextmanager
+def observe_email(kind):
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        yield
+        result = 'sent'
+    finally:
+        EMAIL_LATENCY.observe(time.perf_counter() - start, kind=kind)
+        EMAILS_SENT.inc(kind=kind, result=result)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.sql_queries = 0
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    if 'metrics_start' not in g:
+        return
+    endpoint = metrics_endpoint()
+    HTTP_LATENCY.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=g.get('metrics_status', 500))
+    REQUEST_QUERIES.observe(g.sql_queries, endpoint=endpoint)
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        TEMPLATE_LATENCY.observe(time.perf_counter() - starts.pop(), template=template.name or 'string')
+
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+def record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    endpoint = metrics_endpoint()
+    SQL_QUERIES.inc(endpoint=endpoint)
+    SQL_SECONDS.inc(elapsed, endpoint=endpoint)
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', start_statement_timer)
+    event.listen(db.engine, 'after_cursor_execute', record_statement_time)
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    if rate_limit_store is not None:
+        lines.append('# HELP antlers_rate_limit_rejected_total Requests rejected by the rate limiter, by endpoint.')
+        lines.append('# TYPE antlers_rate_limit_rejected_total counter')
+        for name, count in sorted(rate_limit_store.rejections().items()):
+            lines.append(f'antlers_rate_limit_rejected_total{format_labels((("endpoint", name),))} {count}')
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')
+    if not token_ok and not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Slow-query log.
+# Statements slower than SLOW_QUERY_MS are appended as JSON lines to
+# instance/slow_queries.log (rotated at SLOW_QUERY_LOG_BYTES), with their
+# parameters, the endpoint that ran them and the plan from EXPLAIN. A
+# SLOW_QUERY_ANALYZE_RATE share of slow plain SELECT ... FROM reads is
+# explained with ANALYZE, which runs the query again; writes, locking reads
+# and function calls such as pg_notify only ever get a plain EXPLAIN. The
+# plan is taken on the raw DBAPI cursor so it does not pass through these
+# hooks itself, inside a savepoint on Postgres so a failed EXPLAIN cannot
+# abort the caller's transaction. /admin/slow-queries groups the entries by fingerprint, the
+# statement with literals and placeholders normalised.
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_ANALYZE_RATE = float(os.getenv('SLOW_QUERY_ANALYZE_RATE', '0.1'))
+SLOW_QUERY_LOG_PATH = os.path.join(instance_path, 'slow_queries.log')
+SLOW_QUERY_LOG_BYTES = int(os.getenv('SLOW_QUERY_LOG_BYTES', str(5 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = 3
+
+slow_query_logger = logging.getLogger('antlers.slow_queries')
+slow_query_logger.setLevel(logging.INFO)
+slow_query_logger.propagate = False
+if SLOW_QUERY_MS > 0:
+    slow_query_handler = logging.handlers.RotatingFileHandler(
+        SLOW_QUERY_LOG_PATH, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+    slow_query_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_query_logger.addHandler(slow_query_handler)
+
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+def statement_fingerprint(statement):
+    """Normalise a statement so executions that differ only in values group together"""
+    for pattern, replacement in FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def loggable_parameters(parameters, context):
+    if context.compiled is not None and context.compiled_parameters:
+        parameters = context.compiled_parameters[0]
+    if isinstance(parameters, dict):
+        return {key: '***' if 'password' in key.lower() else repr(value)[:200] for key, value in parameters.items()}
+    return [repr(value)[:200] for value in parameters or ()]
+
+ANALYZE_UNSAFE = re.compile(r'\bFOR\s+(?:UPDATE|SHARE|NO\s+KEY|KEY)\b|\b(?:PG_\w+|NEXTVAL|SETVAL)\s*\(')
+
+def analyze_safe(statement):
+    """Whether running the statement a second time has no side effects"""
+    upper = statement.upper()
+    return upper.lstrip().startswith('SELECT') and re.search(r'\bFROM\b', upper) is not None \
+        and ANALYZE_UNSAFE.search(upper) is None
+
+def explain_statement(conn, cursor, statement, parameters, analyze):
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+    elif dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return None
+    savepoint = dialect == 'postgresql' and not getattr(cursor.connection, 'autocommit', False)
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if savepoint:
+            explain_cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(' '.join(str(column) for column in row) for row in explain_cursor.fetchall())
+        except Exception:
+            if savepoint:
+                explain_cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            raise
+        finally:
+            if savepoint:
+                explain_cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    finally:
+        explain_cursor.close()
+
+def log_slow_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._metrics_start) * 1000
+    if SLOW_QUERY_MS <= 0 or elapsed_ms < SLOW_QUERY_MS:
+        return
+    verb = statement.lstrip()[:6].upper()
+    analyze = conn.dialect.name == 'postgresql' and analyze_safe(statement) and \
+        random.random() < SLOW_QUERY_ANALYZE_RATE
+    plan = None
+    if not executemany and verb in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+        try:
+            plan = explain_statement(conn, cursor, statement, parameters, analyze)
+        except Exception as e:
+            plan = f'EXPLAIN failed: {e}'
+    slow_query_logger.info(json.dumps({
+        'at': datetime.now(timezone.utc).isoformat(),
+        'ms': round(elapsed_ms, 1),
+        'endpoint': metrics_endpoint(),
+        'fingerprint': statement_fingerprint(statement),
+        'statement': statement,
+        'parameters': loggable_parameters(parameters, context),
+        'analyzed': analyze and plan is not None,
+        'plan': plan,
+    }))
+
+with app.app_context():
+    event.listen(db.engine, 'after_cursor_execute', log_slow_statement)
+
+def read_slow_queries():
+    """Entries from the current log and its backups, oldest first"""
+    paths = [f'{SLOW_QUERY_LOG_PATH}.{n}' for n in range(SLOW_QUERY_LOG_BACKUPS, 0, -1)] + [SLOW_QUERY_LOG_PATH]
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+def aggregate_slow_queries():
+    groups = {}
+    for entry in read_slow_queries():
+        group = groups.get(entry['fingerprint'])
+        if group is None:
+            group = groups[entry['fingerprint']] = {
+                'fingerprint': entry['fingerprint'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'endpoints': collections.Counter(), 'last_seen': None, 'slowest': None, 'plan': None,
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        group['last_seen'] = entry['at']
+        group['endpoints'][entry['endpoint']] += 1
+        if entry['ms'] >= group['max_ms']:
+            group['max_ms'] = entry['ms']
+            group['slowest'] = {'statement': entry['statement'], 'parameters': entry['parameters'], 'at': entry['at']}
+        if entry.get('plan') and (entry.get('analyzed') or group['plan'] is None or not group['plan']['analyzed']):
+            group['plan'] = {'text': entry['plan'], 'analyzed': entry.get('analyzed', False)}
+    for group in groups.values():
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 1)
+        group['total_ms'] = round(group['total_ms'], 1)
+        group['endpoints'] = dict(group['endpoints'].most_common())
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+
+@app.route('/admin/slow-queries')
+@login_required
+def admin_slow_queries():
+    if current_user.role != 'admin':
+        if wants_json_response():
+            return jsonify({'error': 'Access denied.'}), 403
+        flash('Access denied.', 'danger')
+        return redirect(url_for('home'))
+    queries = aggregate_slow_queries()
+    if wants_json_response():
+        return jsonify({'threshold_ms': SLOW_QUERY_MS, 'queries': queries})
+    return render_template('admin_slow_queries.html', queries=queries, threshold_ms=SLOW_QUERY_MS)
+
+# Query budgets.
+# In debug or testing mode (or with DETECT_N_PLUS_ONE=1) every request counts
+# its statements by fingerprint and logs a warning for any shape run more
+# than QUERY_REPEAT_THRESHOLD times, the signature of a lazy relationship
+# loaded row by row. max_queries(n) turns a budget into a hard failure for
+# tests: `with max_queries(5): client.get('/chat_history')`.
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', '5'))
+DETECT_N_PLUS_ONE = os.getenv('DETECT_N_PLUS_ONE') == '1'
+query_budgets = threading.local()
+
+class max_queries(contextlib.ContextDecorator):
+    """Raise AssertionError when the block or decorated function runs more
+    than `limit` SQL statements."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.statements = []
+
+    def _recreate_cm(self):
+        # A fresh budget for every call of a decorated function
+        return max_queries(self.limit)
+
+    def __enter__(self):
+        if not hasattr(query_budgets, 'active'):
+            query_budgets.active = []
+        query_budgets.active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        query_budgets.active.remove(self)
+        if exc_type is None and len(self.statements) > self.limit:
+            shapes = collections.Counter(statement_fingerprint(statement) for statement in self.statements)
+            detail = '\n'.join(f'  {count} x {shape}' for shape, count in shapes.most_common(5))
+            raise AssertionError(f'{len(self.statements)} queries run, budget is {self.limit}:\n{detail}')
+        return False
+
+def track_statement_shapes(conn, cursor, statement, parameters, context, executemany):
+    for budget in getattr(query_budgets, 'active', ()):
+        budget.statements.append(statement)
+    if has_request_context() and g.get('statement_shapes') is not None:
+        g.statement_shapes[statement_fingerprint(statement)] += 1
+
+with app.app_context():
+    event.listen(db.engine, 'after_cursor_execute', track_statement_shapes)
+
+@app.before_request
+def start_statement_shapes():
+    g.statement_shapes = collections.Counter() if app.debug or app.testing or DETECT_N_PLUS_ONE else None
+
+@app.teardown_request
+def report_repeated_statements(error=None):
+    shapes = g.get('statement_shapes')
+    if not shapes:
+        return
+    for shape, count in shapes.most_common():
+        if count <= QUERY_REPEAT_THRESHOLD:
+            break
+        app.logger.warning(f"Possible N+1 query in {metrics_endpoint()}: {count} x {shape}")
+
 @app.route('/')
 def main():
     return render_template('main.html')
@@ -392,10 +1553,14 @@ def how_it_works():
     return render_template('how_it_works.html')
 
 @app.route('/community', methods=['GET', 'POST'])
+@rate_limit(3, 300)
 def community():
     """Community chat page"""
     if request.method == 'POST' and current_user.is_authenticated:
-        message = request.form.get('message')
+        wants_json = wants_json_response()
+        message = (request.get_json(silent=True) or {}).get('message') if request.is_json else request.form.get('message')
+        if not message and wants_json:
+            return jsonify({'error': 'Message is required.'}), 400
         if message:
             new_message = CommunityChatMessage(
                 user_id=current_user.id,
@@ -403,7 +1568,8 @@ def community():
             )
             db.session.add(new_message)
             db.session.commit()
-            flash('Message sent successfully!', 'success')
+            if not wants_json:
+                flash('Message sent successfully!', 'success')
             # Email all users (except sender) about new community message
             recipients = [u.email for u in User.query.filter(User.id != current_user.id, User.overall_verified == True).all() if u.email]
             if recipients:
@@ -411,14 +1577,49 @@ def community():
                 body = f"<p><b>{current_user.username}</b> posted in the community chat:</p><blockquote>{message}</blockquote>"
                 for email in recipients:
                     send_notification_email(email, subject, body)
+            if wants_json:
+                return jsonify({'id': new_message.id}), 201
             return redirect(url_for('community'))
     
-    # Get all community messages
-    messages = CommunityChatMessage.query.order_by(CommunityChatMessage.timestamp.desc()).limit(50).all()
-    messages.reverse()  # Show oldest first
+    # Recent community messages come from the in-memory room feed
+    messages = [RoomMessage(m) for m in get_room_feed(COMMUNITY_ROOM).since()]
     
     return render_template('community.html', messages=messages)
 
+@app.route('/community/stream')
+def community_stream():
+    """Server-Sent Events stream of the community chat"""
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_id', 0, type=int)
+    return event_stream(COMMUNITY_ROOM, lambda: get_room_feed(COMMUNITY_ROOM).since(last_id) if last_id else [], last_id)
+
+@app.route('/community/messages')
+def community_messages():
+    """Long-poll for community messages newer than ?since=<id>"""
+    return room_long_poll(COMMUNITY_ROOM)
+
+ROOM_LONG_POLL_SECONDS = 25
+
+def room_long_poll(room):
+    since = request.args.get('since', 0, type=int)
+    feed = get_room_feed(room)
+    messages = feed.since(since)
+    db.session.close()
+    if not messages:
+        subscription = event_broker.subscribe(room)
+        try:
+            # Re-check after subscribing so a message published in between is not missed
+            messages = feed.since(since)
+            deadline = time.time() + ROOM_LONG_POLL_SECONDS
+            while not messages and time.time() < deadline:
+                try:
+                    subscription.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                messages = feed.since(since)
+        finally:
+            event_broker.unsubscribe(room, subscription)
+    return jsonify({'messages': messages, 'last_id': messages[-1]['id'] if messages else since})
+
 @app.route('/delete_community_message/<int:message_id>', methods=['POST'])
 @login_required
 def delete_community_message(message_id):
@@ -468,9 +1669,12 @@ def submit_swap_item():
         condition = request.form.get('condition')
         image = request.files.get('image')
         
-        if image and allowed_file(image.filename):
+        try:
             filename = save_file(image)
-        else:
+        except UploadError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('games'))
+        if not filename:
             flash('Please provide a valid image file.', 'danger')
             return redirect(url_for('games'))
         
@@ -497,8 +1701,7 @@ def game_community(event_id):
     """Game community chat page"""
     try:
         swap_event = SwapEvent.query.get_or_404(event_id)
-        messages = GameCommunityMessage.query.filter_by(swap_event_id=event_id).order_by(GameCommunityMessage.timestamp.desc()).limit(50).all()
-        messages.reverse()
+        messages = [RoomMessage(m) for m in get_room_feed(event_room(event_id)).since()]
         
         return render_template('game_community.html', swap_event=swap_event, messages=messages)
     except Exception as e:
@@ -506,7 +1709,46 @@ def game_community(event_id):
         flash('Event not found or an error occurred. Please check if the event exists.', 'danger')
         return redirect(url_for('games'))
 
+@app.route('/game_community/<int:event_id>/messages', methods=['GET', 'POST'])
+@login_required
+@rate_limit(3, 300)
+def game_community_messages(event_id):
+    """Post to a swap event chat, or long-poll it for messages newer than ?since=<id>"""
+    if request.method == 'GET':
+        if not db.session.get(SwapEvent, event_id):
+            abort(404)
+        return room_long_poll(event_room(event_id))
+    swap_event = SwapEvent.query.get_or_404(event_id)
+    wants_json = wants_json_response()
+    message = ((request.get_json(silent=True) or {}).get('message') if request.is_json else request.form.get('message', '')).strip()
+    if not message:
+        if wants_json:
+            return jsonify({'error': 'Message is required.'}), 400
+        flash('Message cannot be empty.', 'danger')
+        return redirect(url_for('game_community', event_id=event_id))
+    new_message = GameCommunityMessage(
+        user_id=current_user.id,
+        swap_event_id=swap_event.id,
+        message=message
+    )
+    db.session.add(new_message)
+    db.session.commit()
+    if wants_json:
+        return jsonify({'id': new_message.id}), 201
+    return redirect(url_for('game_community', event_id=event_id))
+
+@app.route('/game_community/<int:event_id>/stream')
+@login_required
+def game_community_stream(event_id):
+    """Server-Sent Events stream of a swap event chat"""
+    if not db.session.get(SwapEvent, event_id):
+        abort(404)
+    room = event_room(event_id)
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_id', 0, type=int)
+    return event_stream(room, lambda: get_room_feed(room).since(last_id) if last_id else [], last_id)
+
 @app.route('/contactus', methods=['GET', 'POST'])
+@rate_limit(5, 3600)
 def contactus():
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
@@ -525,10 +1767,10 @@ def contactus():
         if not message:
             errors.append('Message is required.')
         if image_file and image_file.filename:
-            if allowed_file(image_file.filename):
+            try:
                 image_path = save_file(image_file)
-            else:
-                errors.append('Invalid image file type. Allowed: png, jpg, jpeg, gif.')
+            except UploadError as e:
+                errors.append(str(e))
         if errors:
             for error in errors:
                 flash(error, 'danger')
@@ -565,27 +1807,38 @@ def chat_history():
     """Chat history page"""
     # Get all borrow requests where user is borrower or lender
     from sqlalchemy import or_
-    borrow_requests = BorrowedAccessory.query.filter(
+    # The people and item of every thread are loaded up front rather than
+    # one thread at a time while the page renders
+    borrow_requests = BorrowedAccessory.query.options(
+        joinedload(BorrowedAccessory.borrower),
+        joinedload(BorrowedAccessory.lender),
+        joinedload(BorrowedAccessory.accessory),
+    ).filter(
         or_(BorrowedAccessory.borrower_id == current_user.id, BorrowedAccessory.lender_id == current_user.id)
     ).all()
     
+    # Unread counts for every thread in one lookup
+    unread = unread_counts(current_user.id, 'borrow')
+    
+    # The latest message of every thread in one query
+    last_messages = {}
+    if borrow_requests:
+        ranked = db.session.query(ChatMessage.id, func.row_number().over(
+            partition_by=ChatMessage.borrow_id,
+            order_by=(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        ).label('rank')).filter(ChatMessage.borrow_id.in_([r.id for r in borrow_requests])).subquery()
+        latest = ChatMessage.query.join(ranked, ChatMessage.id == ranked.c.id).filter(ranked.c.rank == 1)
+        last_messages = {message.borrow_id: message for message in latest}
+    
     # Create active_chats list with chat information
     active_chats = []
     for borrow_request in borrow_requests:
-        # Get the last message for this borrow request
-        last_message = ChatMessage.query.filter_by(borrow_id=borrow_request.id).order_by(ChatMessage.timestamp.desc()).first()
-        
-        # Count unread messages for current user
-        unread_count = ChatMessage.query.filter_by(
-            borrow_id=borrow_request.id,
-            recipient_id=current_user.id,
-            is_read=False
-        ).count()
+        last_message = last_messages.get(borrow_request.id)
         
         active_chats.append({
             'borrow_request': borrow_request,
             'last_message': last_message,
-            'unread_count': unread_count
+            'unread_count': unread.get(borrow_request.id, 0)
         })
     
     # Sort by last message timestamp (most recent first)
@@ -609,6 +1862,7 @@ def borrow_details(borrow_id):
         flash('You are not authorized to view this request.', 'danger')
         return redirect(url_for('user_dashboard'))
     
+    mark_thread_read(current_user.id, 'borrow', borrow_id)
     # Get chat messages for this borrow request
     chat_messages = ChatMessage.query.filter_by(borrow_id=borrow_id).order_by(ChatMessage.timestamp).all()
     
@@ -630,6 +1884,7 @@ def relist_item(item_id):
         category=item.category,
         location=item.location,
         image=item.image,
+        image_renditions=item.image_renditions,
         type=item.type,
         user_id=current_user.id,
         residence=current_user.residence if hasattr(current_user, 'residence') else ''
@@ -662,6 +1917,8 @@ def delete_item(item_id):
 def swap_item_details(item_id):
     """Swap item details page"""
     swap_item = SwapItem.query.get_or_404(item_id)
+    if current_user.id in (swap_item.user_id, swap_item.recipient_id):
+        mark_thread_read(current_user.id, 'swap', item_id)
     return render_template('swap_item_details.html', item=swap_item)
 
 @app.route('/schedule_swap_meeting/<int:item_id>', methods=['GET', 'POST'])
@@ -719,6 +1976,32 @@ def my_swap_items():
                          my_swap_items=my_swap_items,
                          received_swap_items=received_swap_items)
 
+@app.route('/my_swap_history')
+@login_required
+def my_swap_history():
+    """Swap events the user took part in, newest first"""
+    page = request.args.get('page', 1, type=int)
+    per_page = 10
+    participation = db.select(SwapParticipation.event_id).where(SwapParticipation.user_id == current_user.id)
+    events = SwapEvent.query.filter(SwapEvent.id.in_(participation)) \
+        .order_by(SwapEvent.start_date.desc(), SwapEvent.id.desc()).paginate(page=page, per_page=per_page)
+    event_ids = [swap_event.id for swap_event in events.items]
+    # The user's given and received items for the events on this page
+    given_items = collections.defaultdict(list)
+    received_items = collections.defaultdict(list)
+    if event_ids:
+        rows = db.session.query(swap_event_items.c.event_id, SwapItem) \
+            .join(SwapItem, SwapItem.id == swap_event_items.c.item_id) \
+            .filter(swap_event_items.c.event_id.in_(event_ids),
+                    (SwapItem.user_id == current_user.id) | (SwapItem.recipient_id == current_user.id))
+        for event_id, item in rows:
+            if item.user_id == current_user.id:
+                given_items[event_id].append(item)
+            if item.recipient_id == current_user.id:
+                received_items[event_id].append(item)
+    return render_template('my_swap_history.html', events=events,
+                           given_items=given_items, received_items=received_items)
+
 @app.route('/confirm_return/<int:return_id>', methods=['POST'])
 @login_required
 def confirm_return(return_id):
@@ -773,11 +2056,12 @@ class GmailOTPService:
             <p>This OTP is valid for 5 minutes. Do not share it with anyone.</p>
             """
             msg.attach(MIMEText(body, 'html'))
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(self.email, self.password)
-            server.sendmail(self.email, to_email, msg.as_string())
-            server.quit()
+            with observe_email('otp'):
+                server = smtplib.SMTP('smtp.gmail.com', 587)
+                server.starttls()
+                server.login(self.email, self.password)
+                server.sendmail(self.email, to_email, msg.as_string())
+                server.quit()
             return True, "OTP sent successfully to your email."
         except Exception as e:
             return False, f"Failed to send OTP email: {str(e)}"
@@ -811,6 +2095,7 @@ def register():
 
 # OTP verification route (now email-based)
 @app.route('/verify', methods=['GET', 'POST'])
+@rate_limit(3, 600, when=lambda: request.form.get('action') == 'resend')
 def verify():
     user_id = session.get('pending_user_id')
     if not user_id:
@@ -916,9 +2201,7 @@ def user_dashboard():
     # Get completed swap events where the user participated
     completed_events = SwapEvent.query.filter(
         SwapEvent.status == 'completed',
-        SwapEvent.items.any(
-            (SwapItem.user_id == current_user.id) | (SwapItem.recipient_id == current_user.id)
-        )
+        SwapEvent.id.in_(db.select(SwapParticipation.event_id).where(SwapParticipation.user_id == current_user.id))
     ).all()
 
     # Calculate stats
@@ -1023,6 +2306,43 @@ def admin_dashboard():
                          users=users,
                          stats=stats)
 
+def donation_approved_email(item_name):
+    donation_url = url_for('donations', _external=True)
+    subject = f"Your Donation '{item_name}' was Approved"
+    body = (
+        f"<p><b>Thank you for your generosity! 🙏</b></p>"
+        f"<p>We're happy to let you know that your donation — <b>{item_name}</b> — has been "
+        f"<span style='color:green;'><b>approved</b></span> by our admin team. 🎉</p>"
+        f"<p>Your thoughtful contribution helps strengthen our culture of sharing and support. "
+        f"Every item given brings value to someone in need, and we're grateful to have you as part of this mission.</p>"
+        f"<p><b>Our team at Antlers will contact you shortly</b> to coordinate the pickup of the donated item. "
+        f"Please ensure it's ready and accessible at the agreed time. 🛻</p>"
+        f"<p>You can also track and manage your donations in your dashboard under <b>My Donations</b>.</p>"
+        f"<p>"
+        f"<a href='{donation_url}' style='display:inline-block;padding:10px 20px;"
+        f"background:#4CAF50;color:white;text-decoration:none;border-radius:5px;'>"
+        f"View My Donations</a></p>"
+        f"<p>If the button doesn't work, simply copy and paste this link into your browser:<br>"
+        f"<a href='{donation_url}'>{donation_url}</a></p>"
+        f"<p>With sincere thanks,<br><b>Team Antlers</b></p>"
+    )
+    return subject, body
+
+def donation_rejected_email(item_name, rejection_reason):
+    donation_url = url_for('donations', _external=True)
+    subject = f"Your Donation '{item_name}' was Rejected"
+    body = (
+        f"<p>We appreciate your willingness to donate <b>{item_name}</b>, but unfortunately it was <span style='color:red;'><b>rejected</b></span> by the admin.</p>"
+        f"<p><b>Reason:</b> {rejection_reason}</p>"
+        f"<p>You can track your donations and see the reason for rejection in your dashboard under <b>My Donations</b>.</p>"
+        f"<p><a href='{donation_url}' style='display:inline-block;padding:10px 20px;background:#4CAF50;color:white;text-decoration:none;border-radius:5px;'>View My Donations</a></p>"
+        f"<p>If the button doesn't work, copy and paste this link into your browser:<br>"
+        f"<a href='{donation_url}'>{donation_url}</a></p>"
+        f"<p>Thank you for your spirit of giving. Please consider donating again in the future!</p>"
+        f"<p>Warm regards,<br><b>The Team</b></p>"
+    )
+    return subject, body
+
 @app.route('/approve/<int:item_id>')
 @login_required
 def approve(item_id):
@@ -1037,6 +2357,7 @@ def approve(item_id):
             name=pending_item.name,
             description=pending_item.description,
             image=pending_item.image,
+            image_renditions=pending_item.image_renditions,
             type=pending_item.type,
             category=pending_item.category,
             location=pending_item.location,
@@ -1049,25 +2370,7 @@ def approve(item_id):
         flash('Donation approved! The user will be notified.', 'success')
         # Send Gmail notification to user
         if user and user.email:
-            donation_url = url_for('donations', _external=True)
-            subject = f"Your Donation '{pending_item.name}' was Approved"
-            body = (
-                f"<p><b>Thank you for your generosity! 🙏</b></p>"
-                f"<p>We're happy to let you know that your donation — <b>{pending_item.name}</b> — has been "
-                f"<span style='color:green;'><b>approved</b></span> by our admin team. 🎉</p>"
-                f"<p>Your thoughtful contribution helps strengthen our culture of sharing and support. "
-                f"Every item given brings value to someone in need, and we're grateful to have you as part of this mission.</p>"
-                f"<p><b>Our team at Antlers will contact you shortly</b> to coordinate the pickup of the donated item. "
-                f"Please ensure it's ready and accessible at the agreed time. 🛻</p>"
-                f"<p>You can also track and manage your donations in your dashboard under <b>My Donations</b>.</p>"
-                f"<p>"
-                f"<a href='{donation_url}' style='display:inline-block;padding:10px 20px;"
-                f"background:#4CAF50;color:white;text-decoration:none;border-radius:5px;'>"
-                f"View My Donations</a></p>"
-                f"<p>If the button doesn't work, simply copy and paste this link into your browser:<br>"
-                f"<a href='{donation_url}'>{donation_url}</a></p>"
-                f"<p>With sincere thanks,<br><b>Team Antlers</b></p>"
-            )
+            subject, body = donation_approved_email(pending_item.name)
             send_notification_email(user.email, subject, body)
         return redirect(url_for('admin_dashboard'))
     else:
@@ -1076,6 +2379,7 @@ def approve(item_id):
             name=pending_item.name,
             description=pending_item.description,
             image=pending_item.image,
+            image_renditions=pending_item.image_renditions,
             type=pending_item.type,
             category=pending_item.category,
             location=pending_item.location,
@@ -1112,6 +2416,7 @@ def reject(item_id):
             name=pending_item.name,
             category=pending_item.category,
             image=pending_item.image,
+            image_renditions=pending_item.image_renditions,
             location=pending_item.location,
             residence=item_residence,
             datetime=item_datetime,
@@ -1127,18 +2432,7 @@ def reject(item_id):
             flash('Item has been rejected ... User will be notified.', 'warning')
             # Send Gmail notification to user if donation
             if pending_item.type == 'donate' and user and user.email:
-                donation_url = url_for('donations', _external=True)
-                subject = f"Your Donation '{pending_item.name}' was Rejected"
-                body = (
-                    f"<p>We appreciate your willingness to donate <b>{pending_item.name}</b>, but unfortunately it was <span style='color:red;'><b>rejected</b></span> by the admin.</p>"
-                    f"<p><b>Reason:</b> {rejection_reason}</p>"
-                    f"<p>You can track your donations and see the reason for rejection in your dashboard under <b>My Donations</b>.</p>"
-                    f"<p><a href='{donation_url}' style='display:inline-block;padding:10px 20px;background:#4CAF50;color:white;text-decoration:none;border-radius:5px;'>View My Donations</a></p>"
-                    f"<p>If the button doesn't work, copy and paste this link into your browser:<br>"
-                    f"<a href='{donation_url}'>{donation_url}</a></p>"
-                    f"<p>Thank you for your spirit of giving. Please consider donating again in the future!</p>"
-                    f"<p>Warm regards,<br><b>The Team</b></p>"
-                )
+                subject, body = donation_rejected_email(pending_item.name, rejection_reason)
                 send_notification_email(user.email, subject, body)
         except Exception as e:
             db.session.rollback()
@@ -1147,31 +2441,845 @@ def reject(item_id):
         return redirect(url_for('admin_dashboard'))
     return render_template('reject_item.html', item=pending_item)
 
-def save_file(file):
-    if file:
-        from PIL import Image
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        # Open the image using Pillow
-        image = Image.open(file)
-        # Optionally, resize if width > 1080px
-        max_width = 1080
-        if image.width > max_width:
-            w_percent = (max_width / float(image.width))
-            h_size = int((float(image.height) * float(w_percent)))
+@app.route('/admin/pending/bulk', methods=['POST'])
+@login_required
+def bulk_moderate_pending():
+    """Approve or reject several pending accessories in one transaction"""
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('home'))
+    action = request.form.get('action')
+    item_ids = request.form.getlist('item_ids', type=int)
+    rejection_reason = request.form.get('rejection_reason', '').strip()
+    if action not in ('approve', 'reject') or not item_ids:
+        flash('Select at least one item and an action.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    if action == 'reject' and not rejection_reason:
+        flash('Please provide a reason for rejection', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    try:
+        rows = db.session.query(PendingAccessory, User.email).outerjoin(User, User.id == PendingAccessory.user_id) \
+            .filter(PendingAccessory.id.in_(item_ids)).with_for_update(of=PendingAccessory).all()
+        if action == 'approve':
+            db.session.add_all([Accessory(
+                name=pending_item.name,
+                description=pending_item.description,
+                image=pending_item.image,
+                image_renditions=pending_item.image_renditions,
+                type=pending_item.type,
+                category=pending_item.category,
+                location=pending_item.location,
+                user_id=pending_item.user_id,
+                is_available=True
+            ) for pending_item, _ in rows])
+        else:
+            db.session.add_all([RejectedAccessory(
+                name=pending_item.name,
+                category=pending_item.category,
+                image=pending_item.image,
+                image_renditions=pending_item.image_renditions,
+                location=pending_item.location,
+                residence=pending_item.residence or "Not specified",
+                datetime=pending_item.datetime or func.now(),
+                description=pending_item.description,
+                type=pending_item.type,
+                user_id=pending_item.user_id,
+                rejection_reason=rejection_reason
+            ) for pending_item, _ in rows])
+        # Donors hear back the same way as with single approvals/rejections
+        emails = [
+            (email, *(donation_approved_email(pending_item.name) if action == 'approve'
+                      else donation_rejected_email(pending_item.name, rejection_reason)))
+            for pending_item, email in rows if pending_item.type == 'donate' and email
+        ]
+        PendingAccessory.query.filter(PendingAccessory.id.in_([pending_item.id for pending_item, _ in rows])) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in bulk {action} of pending items {item_ids}: {str(e)}")
+        flash('An error occurred while updating the items.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    queue_notification_emails(emails)
+    message = f"{len(rows)} item(s) {'approved' if action == 'approve' else 'rejected'}."
+    if wants_json_response():
+        return jsonify({'action': action, 'count': len(rows), 'notified': len(emails)})
+    flash(message + (' Donors will be notified.' if emails else ''), 'success' if action == 'approve' else 'warning')
+    return redirect(url_for('admin_dashboard'))
+
+# Upload storage.
+# Uploads are addressed by keys such as 'uploads/ab/cd/<sha256>.jpg' (the value
+# stored in the image columns). LocalStorage keeps them under the static
+# folder of this instance; S3Storage puts them in an S3-compatible bucket so
+# that every web node sees the same files and they survive redeploys.
+UPLOAD_WORK_FOLDER = os.path.join(instance_path, 'upload_work')
+os.makedirs(UPLOAD_WORK_FOLDER, exist_ok=True)
+STORAGE_SIGNED_URL_SECONDS = 3600
+
+def upload_content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+class LocalStorage:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def put_file(self, key, local_path):
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Copy then rename so readers never see a partially written file
+        temp_path = f'{destination}.{os.getpid()}.tmp'
+        shutil.copyfile(local_path, temp_path)
+        os.replace(temp_path, destination)
+
+    def put(self, key, fileobj):
+        destination = self.path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f'{destination}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as out:
+            shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+        os.replace(temp_path, destination)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def url(self, key):
+        return url_for('static', filename=key)
+
+    def signed_url(self, key, expires_in=STORAGE_SIGNED_URL_SECONDS):
+        # The expiry is part of the signed token and checked when served
+        token = media_serializer().dumps({'key': key, 'expires': int(time.time()) + expires_in})
+        return url_for('media', key=key, token=token)
+
+    def keys(self, prefix='uploads/'):
+        for directory, _, filenames in os.walk(os.path.join(self.root, prefix)):
+            for filename in filenames:
+                if not filename.startswith('.') and not filename.endswith('.tmp'):
+                    yield os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, '/')
+
+class S3Storage:
+    """Any S3-compatible object store (AWS S3, MinIO, R2...)."""
+
+    def __init__(self, bucket, endpoint_url=None, region=None, public_url=None,
+                 access_key_id=None, secret_access_key=None):
+        import boto3
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+
+    def _extra_args(self, key):
+        extra = {'ContentType': upload_content_type(key)}
+        if CONTENT_ADDRESSED_PATH.match(key):
+            extra['CacheControl'] = 'public, max-age=31536000, immutable'
+        return extra
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, key, local_path):
+        # upload_file switches to multipart uploads for large files
+        self.client.upload_file(local_path, self.bucket, key, ExtraArgs=self._extra_args(key))
+
+    def put(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=self._extra_args(key))
+
+    def open(self, key):
+        # StreamingBody: read() in chunks without buffering the whole object
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def url(self, key):
+        if self.public_url:
+            return f'{self.public_url}/{key}'
+        return self.signed_url(key)
+
+    def signed_url(self, key, expires_in=STORAGE_SIGNED_URL_SECONDS):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                  ExpiresIn=expires_in)
+
+    def keys(self, prefix='uploads/'):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key']
+
+def create_storage(backend=None):
+    backend = backend or os.getenv('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        return S3Storage(
+            bucket=os.environ['S3_BUCKET'],
+            endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+            region=os.getenv('S3_REGION'),
+            public_url=os.getenv('S3_PUBLIC_URL'),
+            access_key_id=os.getenv('S3_ACCESS_KEY_ID'),
+            secret_access_key=os.getenv('S3_SECRET_ACCESS_KEY')
+        )
+    return LocalStorage(os.path.dirname(os.path.abspath(app.config['UPLOAD_FOLDER'])))
+
+storage = create_storage()
+
+def media_serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='media')
+
+@app.route('/media/<path:key>')
+def media(key):
+    """Serve a signed link to an upload, streamed from the storage backend"""
+    try:
+        token = media_serializer().loads(request.args.get('token', ''))
+    except BadSignature:
+        abort(403)
+    if not isinstance(token, dict) or token.get('key') != key or token.get('expires', 0) < time.time():
+        abort(403)
+    try:
+        stream = storage.open(key)
+    except Exception:
+        abort(404)
+    response = Response(iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''), mimetype=upload_content_type(key))
+    response.call_on_close(stream.close)
+    return response
+
+@app.template_global()
+def media_url(key):
+    """Public URL of an upload in whichever storage backend is configured."""
+    return storage.url(key) if key else ''
+
+@app.cli.command('migrate-uploads')
+@click.option('--source', default='local', help='Backend to copy from (local or s3).')
+@click.option('--dry-run', is_flag=True, help='List the files that would be copied.')
+def migrate_uploads(source, dry_run):
+    """Copy existing uploads into the configured STORAGE_BACKEND."""
+    source_storage = create_storage(source)
+    copied = skipped = 0
+    for key in source_storage.keys():
+        if storage.exists(key):
+            skipped += 1
+            continue
+        if dry_run:
+            click.echo(key)
+        else:
+            with contextlib.closing(source_storage.open(key)) as stream:
+                storage.put(key, stream)
+        copied += 1
+    click.echo(f"{'Would copy' if dry_run else 'Copied'} {copied} file(s), {skipped} already present.")
+
+# Image processing.
+# Uploads are stored as received and the request returns straight away;
+# decoding, resizing and re-encoding happen in a process pool once the row
+# referencing the upload has been committed. The pool works on a local copy
+# and the renditions are written back through the storage backend. The
+# upload itself is never rewritten: its key is the hash of its content and
+# it is served as immutable. Instead the 'detail' JPEG is also stored under
+# its own content hash and the image column is pointed at it, so pages that
+# link the image column directly never serve the full-size upload.
+IMAGE_MAX_WIDTH = 1080
+IMAGE_RENDITION_WIDTHS = {'thumb': 320, 'card': 640, 'detail': 1080}
+IMAGE_RENDITION_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+IMAGE_RENDITION_QUALITY = 75
+IMAGE_POOL_WORKERS = int(os.getenv('IMAGE_POOL_WORKERS', '2'))
+
+def process_image(source_path, output_dir, key):
+    """Runs in a pool worker. Writes WebP and JPEG renditions of the local
+    copy of an upload, no wider than IMAGE_MAX_WIDTH, for each
+    IMAGE_RENDITION_WIDTHS entry into output_dir. Returns the key the
+    downscaled image is stored under and the rendition manifest stored on
+    the model, keyed like uploads."""
+    from PIL import Image, ImageOps
+    try:
+        resample = Image.Resampling.LANCZOS
+    except AttributeError:
+        resample = Image.ANTIALIAS
+    stem = os.path.splitext(os.path.basename(key))[0]
+    key_dir = os.path.dirname(key)
+    with Image.open(source_path) as original:
+        if original.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale that is still at least
+            # as large as the biggest rendition, instead of at full size.
+            target_height = int(original.height * IMAGE_MAX_WIDTH / original.width) or 1
+            original.draft('RGB', (IMAGE_MAX_WIDTH, target_height))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if image.width > IMAGE_MAX_WIDTH:
+            h_size = int(float(image.height) * IMAGE_MAX_WIDTH / float(image.width))
+            image = image.resize((IMAGE_MAX_WIDTH, h_size), resample, reducing_gap=3.0)
+
+        renditions = {}
+        produced = {}
+        for name, width in sorted(IMAGE_RENDITION_WIDTHS.items(), key=lambda item: -item[1]):
+            width = min(width, image.width)
+            if width not in produced:
+                if width < image.width:
+                    resized = image.resize((width, max(1, int(image.height * width / image.width))), resample, reducing_gap=3.0)
+                else:
+                    resized = image
+                produced[width] = {'width': width}
+                for fmt, pil_format in IMAGE_RENDITION_FORMATS.items():
+                    filename = f'{stem}_{width}w.{fmt}'
+                    resized.save(os.path.join(output_dir, filename), format=pil_format,
+                                 quality=IMAGE_RENDITION_QUALITY, optimize=True)
+                    produced[width][fmt] = f'{key_dir}/{filename}'
+            renditions[name] = produced[width]
+        with open(os.path.join(output_dir, os.path.basename(renditions['detail']['jpeg'])), 'rb') as detail:
+            display_key = content_address(hashlib.sha256(detail.read()).hexdigest(), 'jpg')
+        return display_key, renditions
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+def image_pool():
+    # Created on first use so every gunicorn worker forks its own pool
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+        return _image_pool
+
+IMAGE_MODELS = (PendingAccessory, Accessory, RejectedAccessory, SwapItem, ContactMessage)
+
+def image_values(model, **values):
+    # Bulk updates are written without loading rows; bump updated_at by hand
+    # so the item page's validators change with its image
+    if model is Accessory:
+        values['updated_at'] = func.now()
+    return values
+
+def record_renditions(image_path, work_dir, future):
+    try:
+        try:
+            display_key, renditions = future.result()
+        except Exception as e:
+            app.logger.error(f"Image processing failed for {image_path}: {str(e)}")
+            return
+        try:
+            storage.put_file(display_key, os.path.join(work_dir, os.path.basename(renditions['detail']['jpeg'])))
+            for rendition in renditions.values():
+                for fmt in IMAGE_RENDITION_FORMATS:
+                    rendition_path = os.path.join(work_dir, os.path.basename(rendition[fmt]))
+                    if os.path.exists(rendition_path):
+                        storage.put_file(rendition[fmt], rendition_path)
+                        os.remove(rendition_path)
+        except Exception as e:
+            app.logger.error(f"Failed to store renditions for {image_path}: {str(e)}")
+            return
+        manifest = json.dumps(renditions)
+        with app.app_context():
             try:
-                resample = Image.Resampling.LANCZOS
-            except AttributeError:
-                resample = Image.ANTIALIAS
-            image = image.resize((max_width, h_size), resample)
-        # Convert to RGB if needed (for JPEG)
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-        # Save the image with optimized quality
-        image.save(file_path, optimize=True, quality=70)
-        return f'uploads/{filename}'  # Return relative path for template
+                for model in IMAGE_MODELS:
+                    model.query.filter_by(image=image_path).update(
+                        image_values(model, image=display_key, image_renditions=manifest), synchronize_session=False)
+                # The bulk update skips mapper events; refresh JSON-LD images
+                for item in Accessory.query.filter_by(image=display_key):
+                    flag_modified(item, 'image_renditions')
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Failed to record renditions for {image_path}: {str(e)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def share_existing_renditions(image_path):
+    """A deduplicated upload reuses the downscaled image and renditions of
+    the blob it matched, found through the rendition keys, which are named
+    after the upload. Returns False when none have been recorded yet and
+    processing is needed."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    with db.engine.begin() as connection:
+        processed = None
+        for model in IMAGE_MODELS:
+            processed = connection.execute(db.select(model.image, model.image_renditions).where(
+                model.image_renditions.contains(f'/{stem}_')).limit(1)).first()
+            if processed:
+                break
+        if not processed:
+            return False
+        for model in IMAGE_MODELS:
+            connection.execute(db.update(model).where(model.image == image_path).values(
+                image_values(model, image=processed.image, image_renditions=processed.image_renditions)))
+    return True
+
+def queue_image_processing(image_path, work_dir=None):
+    """Process image_path once the current transaction commits, so the row
+    that references it exists when the renditions are recorded. work_dir
+    holds a local copy of the upload named 'source', when one is at hand."""
+    db.session().info.setdefault('pending_images', []).append((image_path, work_dir))
+
+@event.listens_for(db.session, 'after_commit')
+def submit_pending_images(session):
+    for image_path, work_dir in session.info.pop('pending_images', []):
+        if share_existing_renditions(image_path):
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            continue
+        try:
+            if work_dir is None:
+                # Deduplicated upload still waiting on its first processing run
+                work_dir = tempfile.mkdtemp(dir=UPLOAD_WORK_FOLDER)
+                with contextlib.closing(storage.open(image_path)) as stream, open(os.path.join(work_dir, 'source'), 'wb') as out:
+                    shutil.copyfileobj(stream, out, UPLOAD_CHUNK_SIZE)
+            future = image_pool().submit(process_image, os.path.join(work_dir, 'source'), work_dir, image_path)
+        except Exception as e:
+            app.logger.error(f"Could not queue image processing for {image_path}: {str(e)}")
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            continue
+        future.add_done_callback(functools.partial(record_renditions, image_path, work_dir))
+
+def discard_work_dirs(entries):
+    for _, work_dir in entries:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_pending_images(session, previous_transaction):
+    discard_work_dirs(session.info.pop('pending_images', []))
+
+# Upload handling shared by every form that accepts an image.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Leading bytes of each accepted format, mapped to the extension it is stored under
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+class UploadError(ValueError):
+    pass
+
+def sniff_image_extension(header):
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+def save_file(file):
+    """Stream an uploaded image to a local work file in fixed-size chunks,
+    validate it, store it and queue it for processing. Returns the storage
+    key, None when no file was sent, and raises UploadError for a rejected
+    file."""
+    if not file or not file.filename:
+        return None
+    work_dir = tempfile.mkdtemp(dir=UPLOAD_WORK_FOLDER)
+    work_path = os.path.join(work_dir, 'source')
+    try:
+        size = 0
+        header = b''
+        digest = hashlib.sha256()
+        with open(work_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadError(f'Image is too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.')
+                if len(header) < 16:
+                    header += chunk[:16 - len(header)]
+                digest.update(chunk)
+                out.write(chunk)
+        extension = sniff_image_extension(header)
+        if extension is None:
+            raise UploadError('Invalid image file type. Allowed: png, jpg, jpeg, gif.')
+        # Decompression-bomb guard: only the header is read here
+        try:
+            with Image.open(work_path) as image:
+                width, height = image.size
+        except Exception:
+            raise UploadError('The uploaded image could not be read.')
+        if width * height > MAX_UPLOAD_PIXELS:
+            raise UploadError('Image dimensions are too large.')
+        image_path = content_address(digest.hexdigest(), extension)
+        if storage.exists(image_path):
+            # Identical content is already stored; the new row shares that blob
+            shutil.rmtree(work_dir, ignore_errors=True)
+            work_dir = None
+        else:
+            storage.put_file(image_path, work_path)
+    except Exception:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    queue_image_processing(image_path, work_dir)
+    return image_path
+
+def content_address(hex_digest, extension):
+    # Sharded so no single directory grows past a few hundred entries
+    return f'uploads/{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest}.{extension}'
+
+CONTENT_ADDRESSED_PATH = re.compile(r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_\d+w)?\.[a-z]+$')
+
+@app.after_request
+def cache_content_addressed_uploads(response):
+    # A content-addressed URL always names the same image, so browsers and
+    # CDNs may keep it for a year without revalidating
+    if request.endpoint == 'static' and response.status_code == 200 and \
+            CONTENT_ADDRESSED_PATH.match((request.view_args or {}).get('filename', '')):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    flash(f'Upload is too large. Images must be under {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.', 'danger')
+    return redirect(request.referrer or url_for('home'))
+
+# Response compression.
+# Dynamic text responses are compressed on the way out. Buffered bodies are
+# compressed in one go; streamed ones are flushed chunk by chunk so each
+# piece still reaches the client as soon as it is produced.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+}
+
+def preferred_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
     return None
 
+def new_compressor(encoding):
+    """Returns (compress, finish) callables for one response body."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+def compress_stream(chunks, encoding, charset):
+    compress, finish = new_compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(charset)
+        if chunk:
+            yield compress(chunk)
+    yield finish()
+
+@app.after_request
+def compress_response(response):
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304) or \
+            response.direct_passthrough or 'Content-Encoding' in response.headers or \
+            response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = preferred_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        original = response.response
+        if hasattr(original, 'close'):
+            response.call_on_close(original.close)
+        response.response = compress_stream(original, encoding, response.charset)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        compress, finish = new_compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Static assets.
+# `flask build-assets` copies static files into static/dist under names that
+# include a hash of their content, alongside .gz/.br copies for text assets,
+# and writes a manifest mapping the original names to the built ones. While a
+# manifest exists, url_for('static', ...) in templates points at /assets/,
+# which serves the precompressed variant and lets browsers cache it forever.
+STATIC_DIST_FOLDER = os.path.join(app.static_folder, 'dist')
+ASSET_MANIFEST_PATH = os.path.join(STATIC_DIST_FOLDER, 'manifest.json')
+ASSET_SKIP_DIRS = ('uploads', 'dist')
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.xml', '.html'}
+
+@functools.lru_cache(maxsize=None)
+def asset_manifest():
+    # Read once per process; workers pick up a new build when they restart
+    try:
+        with open(ASSET_MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files into static/dist."""
+    shutil.rmtree(STATIC_DIST_FOLDER, ignore_errors=True)
+    manifest = {}
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder:
+            dirs[:] = [d for d in dirs if d not in ASSET_SKIP_DIRS]
+        for name in files:
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, app.static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(rel)
+            built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(STATIC_DIST_FOLDER, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            if ext.lower() in PRECOMPRESS_EXTENSIONS:
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+            manifest[rel] = built
+    with open(ASSET_MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if brotli is None:
+        click.echo('brotli is not installed; wrote gzip copies only.')
+    click.echo(f'Built {len(manifest)} asset(s) into {STATIC_DIST_FOLDER}.')
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Fingerprinted static file, precompressed when the client accepts it"""
+    path = safe_join(STATIC_DIST_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=31536000)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.template_global('url_for')
+def asset_url_for(endpoint, **values):
+    """url_for for templates that sends built static files to /assets/"""
+    if endpoint == 'static':
+        built = asset_manifest().get(values.get('filename'))
+        if built:
+            endpoint, values['filename'] = 'asset', built
+    return url_for(endpoint, **values)
+
+def load_renditions(obj):
+    try:
+        return json.loads(obj.image_renditions) if obj.image_renditions else {}
+    except (TypeError, ValueError):
+        return {}
+
+@app.template_global()
+def image_url(obj, size='card', fmt='jpeg'):
+    """URL of the best rendition of obj.image, or of the upload itself until
+    the pool has produced renditions."""
+    rendition = load_renditions(obj).get(size)
+    if rendition and rendition.get(fmt):
+        return storage.url(rendition[fmt])
+    return storage.url(obj.image) if obj.image else ''
+
+@app.template_global()
+def image_srcset(obj, fmt='jpeg'):
+    """srcset attribute value listing every rendition width of obj.image."""
+    renditions = {r['width']: r[fmt] for r in load_renditions(obj).values() if r.get(fmt)}
+    return ', '.join(f"{storage.url(path)} {width}w" for width, path in sorted(renditions.items()))
+
+# On-demand thumbnails.
+# /img/<key>?w=<width>&fmt=<webp|jpeg> resizes an upload on first request and
+# keeps the result in a disk cache bounded by THUMB_CACHE_MAX_BYTES, evicting
+# the least recently used files first. Only THUMBNAIL_WIDTHS are accepted so
+# arbitrary sizes cannot fill the cache.
+THUMBNAIL_WIDTHS = (160, 320, 640, 1080)
+THUMBNAIL_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+THUMB_CACHE_FOLDER = os.path.join(instance_path, 'thumb_cache')
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+def render_thumbnail(source_path, output_path, width, fmt):
+    """Runs in the image pool."""
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as original:
+        if original.format == 'JPEG' and original.width > width:
+            original.draft('RGB', (width, max(1, int(original.height * width / original.width))))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if image.width > width:
+            image = image.resize((width, max(1, int(image.height * width / image.width))),
+                                 Image.Resampling.LANCZOS, reducing_gap=3.0)
+        temp_path = f'{output_path}.{os.getpid()}.tmp'
+        image.save(temp_path, format=THUMBNAIL_FORMATS[fmt][0], quality=IMAGE_RENDITION_QUALITY, optimize=True)
+        os.replace(temp_path, output_path)
+
+class DiskLRUCache:
+    """Tracks the files under a directory in least-recently-used order.
+
+    Hits touch the file's mtime, so the order is shared with other workers
+    and survives restarts; each worker rescans the directory before evicting
+    so the byte budget holds across all of them."""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _scan(self):
+        entries = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, os.path.join(directory, filename), stat.st_size))
+        entries.sort()
+        self._entries = collections.OrderedDict((path, size) for _, path, size in entries)
+        self._total = sum(self._entries.values())
+
+    def path_for(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, name):
+        path = self.path_for(name)
+        with self._lock:
+            if self._entries is None:
+                self._scan()
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted, possibly by another worker
+                self._total -= self._entries.pop(path, 0)
+                return None
+            if path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                self._entries[path] = os.path.getsize(path)
+                self._total += self._entries[path]
+            return path
+
+    def added(self, path):
+        with self._lock:
+            if self._entries is None:
+                self._scan()
+            size = os.path.getsize(path)
+            self._total += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            if self._total > self.max_bytes:
+                self._scan()
+                while self._total > self.max_bytes and len(self._entries) > 1:
+                    evicted, evicted_size = self._entries.popitem(last=False)
+                    if evicted == path:
+                        self._entries[path] = evicted_size
+                        continue
+                    try:
+                        os.remove(evicted)
+                    except FileNotFoundError:
+                        pass
+                    self._total -= evicted_size
+
+thumbnail_cache = DiskLRUCache(THUMB_CACHE_FOLDER, THUMB_CACHE_MAX_BYTES)
+
+def build_thumbnail(key, name, width, fmt):
+    """Render a thumbnail into the cache and return its path"""
+    path = thumbnail_cache.path_for(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    work_dir = None
+    try:
+        if isinstance(storage, LocalStorage):
+            source_path = storage.path(key)
+            if not os.path.isfile(source_path):
+                abort(404)
+        else:
+            work_dir = tempfile.mkdtemp(dir=UPLOAD_WORK_FOLDER)
+            source_path = os.path.join(work_dir, 'source')
+            try:
+                with contextlib.closing(storage.open(key)) as stream, open(source_path, 'wb') as out:
+                    shutil.copyfileobj(stream, out, UPLOAD_CHUNK_SIZE)
+            except Exception:
+                abort(404)
+        # Resize in the pool so the worker's event loop keeps serving
+        try:
+            image_pool().submit(render_thumbnail, source_path, path, width, fmt).result(timeout=30)
+        except Exception as e:
+            app.logger.error(f"Thumbnail failed for {key} at {width}px: {str(e)}")
+            abort(404)
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    thumbnail_cache.added(path)
+    return path
+
+@app.route('/img/<path:key>')
+def thumbnail(key):
+    """Resized upload, generated on first request and then served from disk"""
+    width = request.args.get('w', type=int)
+    if width not in THUMBNAIL_WIDTHS:
+        abort(400)
+    fmt = request.args.get('fmt')
+    if fmt is None:
+        fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+    if fmt not in THUMBNAIL_FORMATS or not key.startswith('uploads/') or '..' in key.split('/'):
+        abort(400)
+    name = f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}_{width}.{fmt}"
+    path = thumbnail_cache.get(name) or build_thumbnail(key, name, width, fmt)
+    max_age = 31536000 if CONTENT_ADDRESSED_PATH.match(key) else 86400
+    # The cache touches mtime on every hit, so the ETag comes from the name instead
+    try:
+        response = send_file(path, mimetype=THUMBNAIL_FORMATS[fmt][1], etag=name, conditional=True, max_age=max_age)
+    except FileNotFoundError:
+        # Evicted by another worker since the lookup; treat it as a miss
+        path = build_thumbnail(key, name, width, fmt)
+        response = send_file(path, mimetype=THUMBNAIL_FORMATS[fmt][1], etag=name, conditional=True, max_age=max_age)
+    if CONTENT_ADDRESSED_PATH.match(key):
+        response.cache_control.immutable = True
+    response.cache_control.public = True
+    if 'fmt' not in request.args:
+        response.vary.add('Accept')
+    return response
+
+@app.template_global()
+def thumbnail_url(key, width, fmt=None):
+    """URL of an on-demand thumbnail of an upload; width must be in THUMBNAIL_WIDTHS."""
+    if not key:
+        return ''
+    if fmt:
+        return url_for('thumbnail', key=key, w=width, fmt=fmt)
+    return url_for('thumbnail', key=key, w=width)
+
 @app.route('/borrow')
 @login_required
 def borrow():
@@ -1192,12 +3300,7 @@ def lend():
             pickup_datetime = datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M')
             
             # Handle image upload
-            file = request.files.get('image')
-            image_path = None
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(UPLOAD_FOLDER, filename))
-                image_path = os.path.join('uploads', filename)
+            image_path = save_file(request.files.get('image'))
             
             # Create pending item
             pending_item = PendingAccessory(
@@ -1218,6 +3321,12 @@ def lend():
             flash('Item submitted for approval!', 'success')
             return redirect(url_for('user_dashboard'))
             
+        except UploadError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('lend'))
+        except RequestEntityTooLarge:
+            raise
         except Exception as e:
             db.session.rollback()
             print(f"Error in lend route: {str(e)}")  # For debugging
@@ -1230,7 +3339,11 @@ def lend():
 @login_required
 def donate():
     if request.method == 'POST':
-        image = save_file(request.files.get('image'))
+        try:
+            image = save_file(request.files.get('image'))
+        except UploadError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('donate'))
         from datetime import datetime
         datetime_str = request.form.get('datetime')
         pickup_datetime = None
@@ -1259,6 +3372,7 @@ def donate():
 
 @app.route('/borrow_item/<int:item_id>', methods=['GET', 'POST'])
 @login_required
+@rate_limit(10, 3600)
 def borrow_item(item_id):
     item = Accessory.query.get_or_404(item_id)
     if request.method == 'POST':
@@ -1337,14 +3451,16 @@ def borrow_item(item_id):
 @app.route('/borrow_requests')
 @login_required
 def borrow_requests():
+    related = (joinedload(BorrowedAccessory.borrower), joinedload(BorrowedAccessory.lender),
+               joinedload(BorrowedAccessory.accessory))
     # Get pending requests for items owned by the user
-    pending_requests = BorrowedAccessory.query.filter(
+    pending_requests = BorrowedAccessory.query.options(*related).filter(
         BorrowedAccessory.lender_id == current_user.id,
         BorrowedAccessory.status == 'pending'
     ).all()
     
     # Get approved and delivered requests for items owned by the user
-    active_requests = BorrowedAccessory.query.filter(
+    active_requests = BorrowedAccessory.query.options(*related).filter(
         BorrowedAccessory.lender_id == current_user.id,
         BorrowedAccessory.status.in_(['approved', 'delivered'])
     ).all()
@@ -1374,12 +3490,16 @@ def approve_borrow(borrow_id):
         borrowed_item.item_name = accessory.name
         borrowed_item.item_category = accessory.category
         
-        # Delete all other pending borrow requests for this accessory
-        BorrowedAccessory.query.filter(
+        # Delete all other pending borrow requests for this accessory; a bulk
+        # delete skips the after_delete hook, so drop their unread counters too
+        other_requests = BorrowedAccessory.query.filter(
             BorrowedAccessory.accessory_id == accessory.id,
             BorrowedAccessory.id != borrowed_item.id,
             BorrowedAccessory.status == 'pending'
-        ).delete()
+        )
+        delete_unread_counters(db.session.connection(), 'borrow',
+                               other_requests.with_entities(BorrowedAccessory.id).statement)
+        other_requests.delete()
         
         # Update the borrow request status to approved and mark accessory as unavailable
         borrowed_item.status = 'approved'
@@ -1792,41 +3912,26 @@ def lender_dashboard():
 @app.route('/return_requests')
 @login_required
 def return_requests():
-    # Get pending return requests for items owned by the user (as lender)
-    pending_returns_as_lender = ReturnedAccessory.query.filter(
-        ReturnedAccessory.lender_id == current_user.id,
-        ReturnedAccessory.status == 'pending'
-    ).all()
-    
-    # Get approved return requests for items owned by the user (as lender)
-    approved_returns_as_lender = ReturnedAccessory.query.filter(
-        ReturnedAccessory.lender_id == current_user.id,
-        ReturnedAccessory.status == 'approved'
-    ).all()
-    
-    # Get rejected return requests for items owned by the user (as lender)
-    rejected_returns_as_lender = ReturnedAccessory.query.filter(
-        ReturnedAccessory.lender_id == current_user.id,
-        ReturnedAccessory.status == 'rejected'
-    ).all()
-    
-    # Get pending return requests made by the user (as borrower)
-    pending_returns_as_borrower = ReturnedAccessory.query.filter(
-        ReturnedAccessory.borrower_id == current_user.id,
-        ReturnedAccessory.status == 'pending'
+    from sqlalchemy import or_
+    # One query for both sides, with the people and item of each return
+    # loaded alongside, then split by role and status
+    returns = ReturnedAccessory.query.options(
+        joinedload(ReturnedAccessory.borrower),
+        joinedload(ReturnedAccessory.lender),
+        joinedload(ReturnedAccessory.accessory),
+    ).filter(
+        or_(ReturnedAccessory.lender_id == current_user.id, ReturnedAccessory.borrower_id == current_user.id),
+        ReturnedAccessory.status.in_(['pending', 'approved', 'rejected'])
     ).all()
+    as_lender = [r for r in returns if r.lender_id == current_user.id]
+    as_borrower = [r for r in returns if r.borrower_id == current_user.id]
     
-    # Get approved return requests made by the user (as borrower)
-    approved_returns_as_borrower = ReturnedAccessory.query.filter(
-        ReturnedAccessory.borrower_id == current_user.id,
-        ReturnedAccessory.status == 'approved'
-    ).all()
-    
-    # Get rejected return requests made by the user (as borrower)
-    rejected_returns_as_borrower = ReturnedAccessory.query.filter(
-        ReturnedAccessory.borrower_id == current_user.id,
-        ReturnedAccessory.status == 'rejected'
-    ).all()
+    pending_returns_as_lender = [r for r in as_lender if r.status == 'pending']
+    approved_returns_as_lender = [r for r in as_lender if r.status == 'approved']
+    rejected_returns_as_lender = [r for r in as_lender if r.status == 'rejected']
+    pending_returns_as_borrower = [r for r in as_borrower if r.status == 'pending']
+    approved_returns_as_borrower = [r for r in as_borrower if r.status == 'approved']
+    rejected_returns_as_borrower = [r for r in as_borrower if r.status == 'rejected']
     
     # Determine if current user is a lender or borrower for these returns
     is_lender = current_user.id in [r.lender_id for r in pending_returns_as_lender + approved_returns_as_lender]
@@ -1896,10 +4001,14 @@ def confirm_borrower_delivery(borrow_id):
 
 @app.route('/chat/<int:borrow_id>', methods=['GET', 'POST'])
 @login_required
+@rate_limit(30, 60)
 def chat(borrow_id):
     borrow_request = BorrowedAccessory.query.get_or_404(borrow_id)
     if request.method == 'POST':
-        message = request.form.get('message')
+        wants_json = wants_json_response()
+        message = (request.get_json(silent=True) or {}).get('message') if request.is_json else request.form.get('message')
+        if not message and wants_json:
+            return jsonify({'error': 'Message is required.'}), 400
         if message:
             chat_message = ChatMessage(
                 borrow_id=borrow_id,
@@ -1909,7 +4018,8 @@ def chat(borrow_id):
             )
             db.session.add(chat_message)
             db.session.commit()
-            flash('Message sent!', 'success')
+            if not wants_json:
+                flash('Message sent!', 'success')
             # Email recipient about new chat message
             recipient = User.query.get(chat_message.recipient_id)
             if recipient and recipient.email:
@@ -1926,8 +4036,12 @@ def chat(borrow_id):
     f"<p>Warm regards,<br><b>The Team</b></p>"
 )
                 send_notification_email(recipient.email, subject, body)
+            if wants_json:
+                return jsonify(chat_message_event(chat_message)), 201
             return redirect(url_for('chat', borrow_id=borrow_id))
     # For GET requests, render the chat page with messages
+    if current_user.id in (borrow_request.borrower_id, borrow_request.lender_id):
+        mark_thread_read(current_user.id, 'borrow', borrow_id)
     chat_messages = ChatMessage.query.filter_by(borrow_id=borrow_id).order_by(ChatMessage.timestamp.asc()).all()
     
     # Add date variables for template
@@ -1937,22 +4051,134 @@ def chat(borrow_id):
     
     return render_template('chat.html', borrow_request=borrow_request, chat_messages=chat_messages, today=today, yesterday=yesterday)
 
+def wants_json_response():
+    return request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def sse_format(event_data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(event_data)}')
+    return '\n'.join(lines) + '\n\n'
+
+SSE_KEEPALIVE_SECONDS = 15
+
+def event_stream(channel, load_backlog=None, last_id=0):
+    """Build a text/event-stream response for a broker channel.
+
+    The subscription is opened before load_backlog runs, so nothing published
+    in between is lost; events already sent from the backlog are skipped by
+    id. The generator only touches the broker queue, and the database session
+    is released before streaming starts so idle streams hold no connection.
+    """
+    subscription = event_broker.subscribe(channel)
+    try:
+        backlog = list(load_backlog()) if load_backlog else []
+    except Exception:
+        event_broker.unsubscribe(channel, subscription)
+        raise
+    finally:
+        db.session.close()
+    if backlog:
+        last_id = max(last_id, backlog[-1]['id'])
+
+    def generate():
+        sent_id = last_id
+        yield 'retry: 3000\n\n'
+        for event_data in backlog:
+            yield sse_format(event_data, event_data['id'])
+        while True:
+            try:
+                event_data = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            # Deletions carry the id of an older message, not a new position
+            event_id = None if event_data.get('type') == 'delete' else event_data.get('id')
+            if event_id is not None:
+                if event_id <= sent_id:
+                    continue
+                sent_id = event_id
+            yield sse_format(event_data, event_id)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(lambda: event_broker.unsubscribe(channel, subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/chat/<int:borrow_id>/read', methods=['POST'])
+@login_required
+def chat_mark_read(borrow_id):
+    """Mark messages delivered over the stream as read while the chat is open"""
+    borrow_request = BorrowedAccessory.query.get_or_404(borrow_id)
+    if current_user.id not in (borrow_request.borrower_id, borrow_request.lender_id):
+        abort(403)
+    return jsonify({'marked': mark_thread_read(current_user.id, 'borrow', borrow_id)})
+
+@app.route('/chat/<int:borrow_id>/stream')
+@login_required
+def chat_stream(borrow_id):
+    """Server-Sent Events stream of new messages in a borrow chat"""
+    borrow_request = BorrowedAccessory.query.get_or_404(borrow_id)
+    if current_user.id not in (borrow_request.borrower_id, borrow_request.lender_id):
+        abort(403)
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_id', 0, type=int)
+
+    def missed_messages():
+        # Messages sent while the client was disconnected
+        if not last_id:
+            return []
+        missed = ChatMessage.query.filter(ChatMessage.borrow_id == borrow_id, ChatMessage.id > last_id).order_by(ChatMessage.id).all()
+        return [chat_message_event(message) for message in missed]
+
+    return event_stream(f'chat:{borrow_id}', missed_messages, last_id)
+
 def send_notification_email(to_email, subject, body):
+    return send_notification_emails([(to_email, subject, body)]) == 1
+
+def send_notification_emails(messages):
+    """Send (to_email, subject, body) messages over a single SMTP connection.
+    Returns how many were sent."""
+    if not messages:
+        return 0
+    start = time.perf_counter()
     try:
-        msg = MIMEMultipart()
-        msg['From'] = os.getenv('GMAIL_USER')
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'html'))
         server = smtplib.SMTP('smtp.gmail.com', 587)
         server.starttls()
         server.login(os.getenv('GMAIL_USER'), os.getenv('GMAIL_PASS'))
-        server.sendmail(os.getenv('GMAIL_USER'), to_email, msg.as_string())
-        server.quit()
-        return True
     except Exception as e:
         print(f'Failed to send notification email: {e}')
-        return False
+        EMAIL_LATENCY.observe(time.perf_counter() - start, kind='notification')
+        EMAILS_SENT.inc(len(messages), kind='notification', result='error')
+        return 0
+    sent = 0
+    try:
+        for to_email, subject, body in messages:
+            try:
+                msg = MIMEMultipart()
+                msg['From'] = os.getenv('GMAIL_USER')
+                msg['To'] = to_email
+                msg['Subject'] = subject
+                msg.attach(MIMEText(body, 'html'))
+                server.sendmail(os.getenv('GMAIL_USER'), to_email, msg.as_string())
+                sent += 1
+            except Exception as e:
+                print(f'Failed to send notification email to {to_email}: {e}')
+    finally:
+        try:
+            server.quit()
+        except Exception:
+            pass
+        EMAIL_LATENCY.observe(time.perf_counter() - start, kind='notification')
+        EMAILS_SENT.inc(sent, kind='notification', result='sent')
+        EMAILS_SENT.inc(len(messages) - sent, kind='notification', result='error')
+    return sent
+
+def queue_notification_emails(messages):
+    """Send a batch of notification emails in the background."""
+    if messages:
+        threading.Thread(target=send_notification_emails, args=(list(messages),), daemon=True).start()
 
 @app.route('/admin/swap-items')
 @login_required
@@ -2007,10 +4233,148 @@ def manual_assign_item():
         return redirect(url_for('admin_swap_assignments'))
     item.recipient_id = recipient.id
     item.status = 'approved'  # or whatever status is appropriate
+    db.session.flush()
+    refresh_item_swap_participation([item.id])
     db.session.commit()
     flash(f'Item {item.name} assigned to {recipient.username}.', 'success')
     return redirect(url_for('admin_swap_assignments'))
 
+# Automatic swap assignment.
+# Each approved, unassigned item in an event takes part in Top Trading Cycles
+# on behalf of its owner. Owners rank the other owners' items: same category
+# first, then better condition, then earlier submission. Items only point at
+# other owners' items, so nobody is given their own; an item with nothing
+# left to point at stays unassigned. Preferences depend only on
+# (category, condition), so finding an item's best remaining choice walks a
+# handful of classes rather than every item.
+SWAP_CONDITION_RANKS = {'new': 5, 'like new': 4, 'excellent': 4, 'very good': 4, 'good': 3, 'fair': 2, 'used': 2, 'poor': 1}
+
+def swap_condition_rank(condition):
+    return SWAP_CONDITION_RANKS.get(re.sub(r'[\s_-]+', ' ', (condition or '').strip().lower()), 2)
+
+def top_trading_cycles(items):
+    """items: iterable of (item_id, owner_id, category, condition).
+    Returns {item_id: item_id that its owner receives in exchange}."""
+    owner, item_class, members = {}, {}, collections.defaultdict(list)
+    for item_id, owner_id, category, condition in sorted(items):
+        key = ((category or '').strip().lower(), swap_condition_rank(condition))
+        owner[item_id] = owner_id
+        item_class[item_id] = key
+        members[key].append(item_id)
+    preferences = {}
+    for category, _ in members:
+        if category not in preferences:
+            preferences[category] = sorted(members, key=lambda key: (key[0] != category, -key[1], key[0]))
+    remaining = set(owner)
+    # Per class: index of the first remaining item, and of the first remaining
+    # item after it with a different owner. Both only move forward, so one
+    # owner holding most of a class doesn't make every lookup rescan it.
+    first_remaining = dict.fromkeys(members, 0)
+    first_other = dict.fromkeys(members, 0)
+
+    def best_choice(item_id):
+        for key in preferences[item_class[item_id][0]]:
+            ids = members[key]
+            start = first_remaining[key]
+            while start < len(ids) and ids[start] not in remaining:
+                start += 1
+            first_remaining[key] = start
+            if start == len(ids):
+                continue
+            if owner[ids[start]] != owner[item_id]:
+                return ids[start]
+            other = max(first_other[key], start + 1)
+            while other < len(ids) and (ids[other] not in remaining or owner[ids[other]] == owner[item_id]):
+                other += 1
+            first_other[key] = other
+            if other < len(ids):
+                return ids[other]
+        return None
+
+    assignment, pointer = {}, {}
+    for seed in owner:
+        if seed not in remaining:
+            continue
+        # Follow pointers until they close a cycle; trade along it and carry
+        # on from the item that pointed into it
+        path, position = [seed], {seed: 0}
+        while path:
+            current = path[-1]
+            choice = pointer.get(current)
+            if choice is None or choice not in remaining:
+                choice = pointer[current] = best_choice(current)
+            if choice is None:
+                remaining.discard(current)
+                del position[current]
+                path.pop()
+            elif choice in position:
+                cycle = path[position[choice]:]
+                del path[position[choice]:]
+                for giver, wanted in zip(cycle, cycle[1:] + cycle[:1]):
+                    assignment[giver] = wanted
+                    remaining.discard(giver)
+                    del position[giver]
+            else:
+                position[choice] = len(path)
+                path.append(choice)
+    return assignment
+
+def plan_swap_assignments(event_id, lock=False):
+    query = db.session.query(SwapItem.id, SwapItem.user_id, SwapItem.category, SwapItem.condition, SwapItem.name) \
+        .join(swap_event_items, swap_event_items.c.item_id == SwapItem.id) \
+        .filter(swap_event_items.c.event_id == event_id, SwapItem.status == 'approved', SwapItem.recipient_id.is_(None))
+    if lock:
+        query = query.with_for_update(of=SwapItem)
+    rows = {row.id: row for row in query}
+    started = time.perf_counter()
+    assignment = top_trading_cycles((row.id, row.user_id, row.category, row.condition) for row in rows.values())
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    # For each trade X -> Y: X's owner receives Y, so Y goes to X's owner
+    plan = [{
+        'item_id': wanted,
+        'item_name': rows[wanted].name,
+        'owner_id': rows[wanted].user_id,
+        'recipient_id': rows[giver].user_id,
+        'in_exchange_for': giver,
+    } for giver, wanted in assignment.items()]
+    unassigned = sorted(set(rows) - set(assignment))
+    return plan, unassigned, elapsed_ms
+
+@app.route('/admin/swap-events/<int:event_id>/auto-assign', methods=['GET', 'POST'])
+@login_required
+def auto_assign_swap_items(event_id):
+    """GET previews the assignment as JSON; POST applies it"""
+    if current_user.role != 'admin':
+        if request.method == 'GET' or wants_json_response():
+            return jsonify({'error': 'Access denied.'}), 403
+        flash('You do not have permission to perform this action.', 'danger')
+        return redirect(url_for('home'))
+    SwapEvent.query.get_or_404(event_id)
+    if request.method == 'GET':
+        plan, unassigned, elapsed_ms = plan_swap_assignments(event_id)
+        return jsonify({'event_id': event_id, 'dry_run': True, 'assignments': plan,
+                        'unassigned': unassigned, 'elapsed_ms': round(elapsed_ms, 1)})
+    try:
+        plan, unassigned, elapsed_ms = plan_swap_assignments(event_id, lock=True)
+        if plan:
+            # One executemany UPDATE by primary key
+            db.session.execute(db.update(SwapItem), [
+                {'id': entry['item_id'], 'recipient_id': entry['recipient_id'], 'received_item_id': entry['in_exchange_for']}
+                for entry in plan
+            ])
+            refresh_item_swap_participation([entry['item_id'] for entry in plan])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Auto-assignment failed for swap event {event_id}: {str(e)}")
+        flash('An error occurred while assigning items.', 'danger')
+        return redirect(url_for('admin_swap_assignments'))
+    if wants_json_response():
+        return jsonify({'event_id': event_id, 'dry_run': False, 'assignments': plan,
+                        'unassigned': unassigned, 'elapsed_ms': round(elapsed_ms, 1)})
+    flash(f'Assigned {len(plan)} item(s); {len(unassigned)} could not be matched.', 'success')
+    return redirect(url_for('admin_swap_assignments'))
+
 @app.route('/admin/start-swap-event/<int:event_id>', methods=['POST'])
 @login_required
 def start_swap_event(event_id):
@@ -2067,6 +4431,103 @@ def complete_swap_event(event_id):
     
     return redirect(url_for('admin_swap_items'))
 
+# Weekly swap events.
+# schedule_weekly_swap_events() runs every SWAP_EVENT_CHECK_MINUTES under the
+# elected scheduler and is safe to run any number of times: it closes events
+# whose end has passed, starts events whose start has come (attaching the
+# approved items first), and makes sure the next weekly event exists.
+SWAP_EVENT_START_HOUR = int(os.getenv('SWAP_EVENT_START_HOUR', '10'))
+SWAP_EVENT_DURATION = timedelta(hours=2)
+SWAP_EVENT_CHECK_MINUTES = 15
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def next_swap_event_start(scheduled_day, now):
+    weekday = WEEKDAYS.index(scheduled_day)
+    start = (now + timedelta(days=(weekday - now.weekday()) % 7)).replace(
+        hour=SWAP_EVENT_START_HOUR, minute=0, second=0, microsecond=0)
+    return start if start > now else start + timedelta(days=7)
+
+def attach_approved_swap_items(event_id):
+    """Add every approved, unassigned swap item to the event in one INSERT ... SELECT."""
+    already_attached = db.exists().where(swap_event_items.c.event_id == event_id,
+                                         swap_event_items.c.item_id == SwapItem.id)
+    approved = db.select(db.literal(event_id), SwapItem.id).where(
+        SwapItem.status == 'approved', SwapItem.recipient_id.is_(None), ~already_attached)
+    attached = db.session.execute(swap_event_items.insert().from_select(['event_id', 'item_id'], approved)).rowcount
+    refresh_swap_participation([event_id])
+    return attached
+
+def refresh_swap_participation(event_ids=None):
+    """Rebuild swap_participation for the given events (all when None) from
+    their items' owners and recipients. Call it whenever items are attached
+    to an event or assigned; it runs in the caller's transaction."""
+    table = SwapParticipation.__table__
+    delete = table.delete()
+    if event_ids is not None:
+        delete = delete.where(table.c.event_id.in_(event_ids))
+    db.session.execute(delete)
+    for role, user_column in (('owner', SwapItem.user_id), ('recipient', SwapItem.recipient_id)):
+        rows = db.select(user_column, swap_event_items.c.event_id, db.literal(role)) \
+            .select_from(swap_event_items.join(SwapItem, SwapItem.id == swap_event_items.c.item_id)) \
+            .where(user_column.isnot(None)).distinct()
+        if event_ids is not None:
+            rows = rows.where(swap_event_items.c.event_id.in_(event_ids))
+        db.session.execute(table.insert().from_select(['user_id', 'event_id', 'role'], rows))
+
+def refresh_item_swap_participation(item_ids):
+    """Rebuild swap_participation for every event the items are attached to,
+    after their owner or recipient changed."""
+    event_ids = [event_id for (event_id,) in db.session.query(swap_event_items.c.event_id).filter(
+        swap_event_items.c.item_id.in_(item_ids)).distinct()]
+    if event_ids:
+        refresh_swap_participation(event_ids)
+
+def schedule_weekly_swap_events():
+    with app.app_context():
+        now = datetime.now()
+        try:
+            # Close events that are over; pending ones that never started close too
+            completed = SwapEvent.query.filter(SwapEvent.status.in_(('pending', 'active')), SwapEvent.end_date <= now) \
+                .update({'status': 'completed'}, synchronize_session=False)
+
+            started = 0
+            for swap_event in SwapEvent.query.filter(SwapEvent.status == 'pending', SwapEvent.start_date <= now):
+                attach_approved_swap_items(swap_event.id)
+                item_count = db.session.query(func.count()).select_from(swap_event_items) \
+                    .filter(swap_event_items.c.event_id == swap_event.id).scalar()
+                if item_count >= 2:
+                    swap_event.status = 'active'
+                    started += 1
+
+            created = None
+            upcoming = SwapEvent.query.filter(SwapEvent.is_weekly == True, SwapEvent.status.in_(('pending', 'active'))).first()
+            # The next weekly event copies the latest one; until an admin has
+            # set one up with a valid day there is no schedule to follow
+            template = None if upcoming else SwapEvent.query.filter_by(is_weekly=True) \
+                .order_by(SwapEvent.start_date.desc()).first()
+            if template is not None and template.scheduled_day in WEEKDAYS:
+                start = next_swap_event_start(template.scheduled_day, now)
+                created = SwapEvent(
+                    name=f"Weekly Swap Meet – {start.strftime('%d %b %Y')}",
+                    description=template.description,
+                    start_date=start,
+                    end_date=start + SWAP_EVENT_DURATION,
+                    status='pending',
+                    is_weekly=True,
+                    scheduled_day=template.scheduled_day
+                )
+                db.session.add(created)
+                db.session.flush()
+                attach_approved_swap_items(created.id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Weekly swap event scheduling failed: {str(e)}")
+            raise
+        if completed or started or created:
+            print(f"Swap events: {completed} completed, {started} started"
+                  + (f", created '{created.name}'" if created else '') + '.')
+
 @app.route('/admin/approve-swap-item/<int:item_id>', methods=['POST'])
 @login_required
 def approve_swap_item(item_id):
@@ -2125,6 +4586,39 @@ def reject_swap_item(item_id):
     
     return redirect(url_for('admin_swap_items'))
 
+@app.route('/admin/swap-items/bulk', methods=['POST'])
+@login_required
+def bulk_moderate_swap_items():
+    """Approve or reject several pending swap items with one UPDATE"""
+    if current_user.role != 'admin':
+        flash('You do not have permission to perform this action.', 'danger')
+        return redirect(url_for('admin_swap_items'))
+    action = request.form.get('action')
+    item_ids = request.form.getlist('item_ids', type=int)
+    rejection_reason = request.form.get('rejection_reason', '').strip()
+    if action not in ('approve', 'reject') or not item_ids:
+        flash('Select at least one item and an action.', 'danger')
+        return redirect(url_for('admin_swap_items'))
+    if action == 'reject' and not rejection_reason:
+        flash('Please provide a rejection reason.', 'danger')
+        return redirect(url_for('admin_swap_items'))
+    values = {'status': 'approved'} if action == 'approve' else {'status': 'rejected', 'rejection_reason': rejection_reason}
+    try:
+        count = SwapItem.query.filter(SwapItem.id.in_(item_ids), SwapItem.status == 'pending') \
+            .update(values, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in bulk {action} of swap items {item_ids}: {str(e)}")
+        flash('An error occurred while updating the items.', 'danger')
+        return redirect(url_for('admin_swap_items'))
+    if wants_json_response():
+        return jsonify({'action': action, 'count': count})
+    skipped = len(set(item_ids)) - count
+    flash(f"{count} swap item(s) {'approved' if action == 'approve' else 'rejected'}."
+          + (f' {skipped} were no longer pending.' if skipped else ''), 'success')
+    return redirect(url_for('admin_swap_items'))
+
 @app.route('/secret')
 @login_required
 def secret():
@@ -2144,6 +4638,150 @@ def donations():
     rejected_donations = RejectedAccessory.query.filter_by(user_id=current_user.id, type='donate').all()
     return render_template('donation.html', approved_donations=approved_donations, rejected_donations=rejected_donations)
 
+# Structured data.
+# JSON-LD for item and blog pages is built whenever the row is written and
+# stored on it, so the detail templates embed it without further queries.
+# Absolute URLs use SITE_URL when set, or the host of the current request.
+# Rows written outside a request while SITE_URL is unset (startup, the image
+# pool, scheduled jobs) are left without JSON-LD, and the page builds it
+# itself until the row is next written in a request.
+SITE_URL = os.getenv('SITE_URL', '').rstrip('/')
+JSON_LD_CURRENCY = os.getenv('JSON_LD_CURRENCY', 'INR')
+JSON_LD_DESCRIPTION_LENGTH = 160
+
+def json_ld_context():
+    """Context to build absolute URLs in, or None when there is no base URL"""
+    if SITE_URL:
+        return app.test_request_context(base_url=SITE_URL)
+    if has_request_context():
+        return contextlib.nullcontext()
+    return None
+
+def json_ld_image_url(key):
+    """Absolute URL of an image that stays valid as long as the JSON-LD does"""
+    if re.match(r'https?://', key):
+        return key
+    if isinstance(storage, S3Storage) and not storage.public_url:
+        # storage.url() would be a presigned link that expires
+        url = url_for('thumbnail', key=key, w=THUMBNAIL_WIDTHS[-1], fmt='jpeg')
+    else:
+        url = storage.url(key)
+    return urljoin(request.host_url, url)
+
+def json_ld_images(obj):
+    renditions = load_renditions(obj)
+    keys = [renditions[size]['jpeg'] for size in ('detail', 'card') if renditions.get(size, {}).get('jpeg')]
+    if not keys and obj.image:
+        keys = [obj.image]
+    return [json_ld_image_url(key) for key in dict.fromkeys(keys)]
+
+def plain_summary(text, length=JSON_LD_DESCRIPTION_LENGTH):
+    text = ' '.join(re.sub(r'<[^>]+>', ' ', text or '').split())
+    return text if len(text) <= length else text[:length - 1].rsplit(' ', 1)[0] + '…'
+
+def item_json_ld(item, connection):
+    context = json_ld_context()
+    if context is None:
+        return None
+    owner = connection.execute(db.select(User.username).where(User.id == item.user_id)).scalar()
+    with context:
+        data = {
+            '@context': 'https://schema.org',
+            '@type': 'Product',
+            'name': item.name,
+            'description': plain_summary(item.description),
+            'category': item.category,
+            'image': json_ld_images(item),
+            'offers': {
+                '@type': 'Offer',
+                'price': '0',
+                'priceCurrency': JSON_LD_CURRENCY,
+                'availability': 'https://schema.org/InStock' if item.is_available is not False else 'https://schema.org/OutOfStock',
+                'seller': {'@type': 'Person', 'name': owner} if owner else None,
+            },
+        }
+        if item.slug:
+            data['url'] = data['offers']['url'] = url_for('item_detail', slug=item.slug, _external=True)
+    return json_ld_blob(data)
+
+def blog_json_ld(post):
+    context = json_ld_context()
+    if context is None:
+        return None
+    published = post.created_at if isinstance(post.created_at, datetime) else datetime.utcnow()
+    modified = post.updated_at if isinstance(post.updated_at, datetime) else published
+    with context:
+        data = {
+            '@context': 'https://schema.org',
+            '@type': 'BlogPosting',
+            'headline': post.title,
+            'description': plain_summary(post.content),
+            'author': {'@type': 'Person', 'name': post.author},
+            'datePublished': published.isoformat(timespec='seconds'),
+            'dateModified': modified.isoformat(timespec='seconds'),
+            'keywords': [tag.strip() for tag in (post.tags or '').split(',') if tag.strip()],
+            'image': [json_ld_image_url(post.image_url)] if post.image_url else [],
+        }
+        if post.slug:
+            data['url'] = url_for('blog_post', slug=post.slug, _external=True)
+            data['mainEntityOfPage'] = {'@type': 'WebPage', '@id': data['url']}
+    return json_ld_blob(data)
+
+def json_ld_blob(data):
+    def prune(value):
+        if isinstance(value, dict):
+            return {k: prune(v) for k, v in value.items() if v not in (None, '', [])}
+        return value
+    # Escapes <, > and & so the blob is safe inside a <script> element
+    return str(htmlsafe_json_dumps(prune(data)))
+
+# Without a base URL nothing can be built; the stored blob is kept as it is
+@event.listens_for(Accessory, 'before_insert')
+@event.listens_for(Accessory, 'before_update')
+def refresh_item_json_ld(mapper, connection, target):
+    blob = item_json_ld(target, connection)
+    if blob:
+        target.json_ld = blob
+
+@event.listens_for(BlogPost, 'before_update')
+def stamp_blog_updated_at(mapper, connection, target):
+    # Set here instead of by onupdate so dateModified below sees this update
+    target.updated_at = datetime.utcnow()
+
+@event.listens_for(BlogPost, 'before_insert')
+@event.listens_for(BlogPost, 'before_update')
+def refresh_blog_json_ld(mapper, connection, target):
+    blob = blog_json_ld(target)
+    if blob:
+        target.json_ld = blob
+
+def backfill_json_ld():
+    """Build JSON-LD for rows written before the column existed, once
+    SITE_URL gives a base for its URLs."""
+    for model in (Accessory, BlogPost):
+        # Earlier builds used http://localhost when there was no base URL
+        model.query.filter(model.json_ld.like('%"http://localhost/%')).update(
+            {'json_ld': None, 'updated_at': func.now()}, synchronize_session=False)
+    db.session.commit()
+    if not SITE_URL:
+        return
+    for model in (Accessory, BlogPost):
+        for obj in model.query.filter(model.json_ld.is_(None)).yield_per(200):
+            flag_modified(obj, 'json_ld')
+        db.session.commit()
+
+@app.template_global()
+def json_ld_script(obj):
+    """<script> element carrying the stored JSON-LD of an item or blog post."""
+    blob = getattr(obj, 'json_ld', None)
+    if not blob and isinstance(obj, Accessory):
+        blob = item_json_ld(obj, db.session.connection())
+    elif not blob and isinstance(obj, BlogPost):
+        blob = blog_json_ld(obj)
+    if not blob:
+        return ''
+    return Markup(f'<script type="application/ld+json">{blob}</script>')
+
 # After all models and db/app initialization, but before route definitions
 with app.app_context():
     create_tables_and_admin()
@@ -2152,27 +4790,77 @@ def generate_slug(name):
     slug = re.sub(r'[^a-zA-Z0-9]+', '-', name.lower()).strip('-')
     return slug
 
+# Conditional GET for public detail pages.
+# Validators come from the page's own row, looked up without loading it, so
+# an unchanged page is answered with a 304 before anything else is queried.
+# The sidebars (related items, categories) are not part of the validator and
+# refresh the next time the row itself changes.
+def page_validators(kind, row_id, updated_at):
+    # Signed-in pages also show the unread badge and the viewer's own
+    # borrow/request state, which the row doesn't version, so only
+    # anonymous views get validators
+    if current_user.is_authenticated:
+        return None, None
+    version = updated_at.isoformat() if updated_at else ''
+    etag = hashlib.sha1(f'{kind}:{row_id}:{version}'.encode('utf-8')).hexdigest()
+    last_modified = updated_at.replace(microsecond=0, tzinfo=timezone.utc) if updated_at else None
+    return etag, last_modified
+
+def not_modified(etag, last_modified):
+    if etag is None or session.get('_flashes'):
+        # Pending flash messages have to be rendered into the page
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def with_validators(response, etag, last_modified):
+    response = app.make_response(response)
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Private with Vary: Cookie so a signed-in page never answers for a
+    # signed-out one, or the other way round
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
 @app.route('/item/<slug>')
 def item_detail(slug):
-    item = Accessory.query.filter_by(slug=slug).first_or_404()
+    row = db.session.query(Accessory.id, Accessory.updated_at, Accessory.created_at).filter_by(slug=slug).first()
+    if row is None:
+        abort(404)
+    etag, last_modified = page_validators('item', row.id, row.updated_at or row.created_at)
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+    item = db.session.get(Accessory, row.id)
     # Fetch related items in the same category, excluding the current item
     related_items = Accessory.query.filter(Accessory.category == item.category, Accessory.id != item.id, Accessory.is_available == True).limit(4).all()
-    return render_template('item_detail.html', item=item, related_items=related_items)
+    return with_validators(render_template('item_detail.html', item=item, related_items=related_items), etag, last_modified)
 
 # Email notification for new draft using Gmail SMTP and environment variables
 
-def notify_admin_new_draft(blog):
+def notify_admin_new_drafts(blogs):
     admin_email = os.getenv('GMAIL_USER')
     admin_pass = os.getenv('GMAIL_PASS')
-    subject = 'New AI Blog Draft Ready'
-    body = f"A new AI-generated blog draft is ready for review: {blog.title}\n\nGo to your admin dashboard to review and approve."
+    if len(blogs) == 1:
+        subject = 'New AI Blog Draft Ready'
+        body = f"A new AI-generated blog draft is ready for review: {blogs[0].title}\n\nGo to your admin dashboard to review and approve."
+    else:
+        subject = f'{len(blogs)} New AI Blog Drafts Ready'
+        titles = '\n'.join(f"- {blog.title}" for blog in blogs)
+        body = f"{len(blogs)} new AI-generated blog drafts are ready for review:\n\n{titles}\n\nGo to your admin dashboard to review and approve."
     msg = MIMEMultipart()
     msg['From'] = admin_email
     msg['To'] = admin_email
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
     try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
+        with observe_email('admin_drafts'), smtplib.SMTP('smtp.gmail.com', 587) as server:
             server.starttls()
             server.login(admin_email, admin_pass)
             server.sendmail(admin_email, admin_email, msg.as_string())
@@ -2246,7 +4934,13 @@ def blog():
 # Public: Individual blog post (only approved)
 @app.route('/blog/<slug>')
 def blog_post(slug):
-    post = BlogPost.query.filter_by(slug=slug, status='approved').first_or_404()
+    row = db.session.query(BlogPost.id, BlogPost.updated_at, BlogPost.created_at).filter_by(slug=slug, status='approved').first()
+    if row is None:
+        abort(404)
+    etag, last_modified = page_validators('blog', row.id, row.updated_at or row.created_at)
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+    post = db.session.get(BlogPost, row.id)
     categories = list(set(tag for post in BlogPost.query.filter_by(status='approved').all() for tag in (post.tags or '').split(',')))
     recent_posts = BlogPost.query.filter_by(status='approved').order_by(BlogPost.created_at.desc()).limit(5).all()
     # Parse source_links JSON for this post
@@ -2257,7 +4951,241 @@ def blog_post(slug):
             post.links = []
     else:
         post.links = []
-    return render_template('blog_post.html', post=post, categories=categories, recent_posts=recent_posts)
+    return with_validators(render_template('blog_post.html', post=post, categories=categories, recent_posts=recent_posts), etag, last_modified)
+
+# Sitemaps.
+# /sitemap.xml is an index of child sitemaps, each covering a fixed range of
+# ids so that a change only ever affects one child. Children are written to
+# disk by streaming rows with yield_per, shared by every worker, and deleted
+# after a commit that inserts, updates or deletes a row in their range; the
+# next crawler request rebuilds just that file. Files are also rebuilt once
+# they are older than SITEMAP_MAX_AGE, which covers changes made on other
+# nodes and bulk updates that skip the mapper events.
+SITEMAP_FOLDER = os.path.join(instance_path, 'sitemaps')
+SITEMAP_CHUNK_SIZE = 5000
+SITEMAP_MAX_AGE = int(os.getenv('SITEMAP_MAX_AGE', '3600'))
+SITEMAP_XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ROBOTS_DISALLOW = ['/admin', '/approve/', '/reject/', '/chat', '/profile', '/user', '/login', '/register',
+                   '/verify', '/logout', '/borrow_details/', '/swap_item_details/', '/media/', '/img/', '/secret']
+
+def sitemap_sources():
+    # kind -> (model, rows that get a public page, endpoint of that page)
+    return {
+        'items': (Accessory, Accessory.slug.isnot(None), 'item_detail'),
+        'blog': (BlogPost, BlogPost.status == 'approved', 'blog_post'),
+    }
+
+def sitemap_lastmod(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+def write_sitemap_index(out):
+    out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_XMLNS}">\n')
+    for kind, (model, condition, endpoint) in sitemap_sources().items():
+        chunks = db.session.query(model.id // SITEMAP_CHUNK_SIZE, func.max(func.coalesce(model.updated_at, model.created_at))) \
+            .filter(condition).group_by(model.id // SITEMAP_CHUNK_SIZE).order_by(model.id // SITEMAP_CHUNK_SIZE)
+        for chunk, lastmod in chunks:
+            out.write(f'<sitemap><loc>{xml_escape(url_for("sitemap_chunk", kind=kind, chunk=chunk, _external=True))}</loc>')
+            if lastmod:
+                out.write(f'<lastmod>{sitemap_lastmod(lastmod)}</lastmod>')
+            out.write('</sitemap>\n')
+    out.write('</sitemapindex>\n')
+
+def write_sitemap_chunk(out, kind, chunk):
+    model, condition, endpoint = sitemap_sources()[kind]
+    rows = db.session.query(model.slug, func.coalesce(model.updated_at, model.created_at)).filter(
+        condition, model.id >= chunk * SITEMAP_CHUNK_SIZE, model.id < (chunk + 1) * SITEMAP_CHUNK_SIZE
+    ).order_by(model.id).execution_options(yield_per=500)
+    out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_XMLNS}">\n')
+    for slug, lastmod in rows:
+        out.write(f'<url><loc>{xml_escape(url_for(endpoint, slug=slug, _external=True))}</loc>')
+        if lastmod:
+            out.write(f'<lastmod>{sitemap_lastmod(lastmod)}</lastmod>')
+        out.write('</url>\n')
+    out.write('</urlset>\n')
+
+def send_sitemap(name, write):
+    path = os.path.join(SITEMAP_FOLDER, name)
+    try:
+        fresh = time.time() - os.path.getmtime(path) < SITEMAP_MAX_AGE
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        os.makedirs(SITEMAP_FOLDER, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as out:
+                write(out)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    response = send_file(path, mimetype='application/xml', conditional=True, max_age=SITEMAP_MAX_AGE)
+    # Let the compression hook gzip it; sitemaps compress very well
+    response.direct_passthrough = False
+    response.cache_control.public = True
+    return response
+
+@app.route('/sitemap.xml')
+def sitemap_index():
+    return send_sitemap('index.xml', write_sitemap_index)
+
+@app.route('/sitemaps/<kind>-<int:chunk>.xml')
+def sitemap_chunk(kind, chunk):
+    if kind not in sitemap_sources():
+        abort(404)
+    # Only chunks listed in the index exist; any other number would leave a
+    # file behind in SITEMAP_FOLDER
+    model, condition, endpoint = sitemap_sources()[kind]
+    if db.session.query(model.id).filter(
+        condition, model.id >= chunk * SITEMAP_CHUNK_SIZE, model.id < (chunk + 1) * SITEMAP_CHUNK_SIZE
+    ).first() is None:
+        abort(404)
+    return send_sitemap(f'{kind}-{chunk}.xml', lambda out: write_sitemap_chunk(out, kind, chunk))
+
+@app.route('/robots.txt')
+def robots_txt():
+    lines = ['User-agent: *'] + [f'Disallow: {path}' for path in ROBOTS_DISALLOW]
+    lines.append(f"Sitemap: {url_for('sitemap_index', _external=True)}")
+    response = Response('\n'.join(lines) + '\n', mimetype='text/plain')
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+def mark_sitemap_stale(kind, target):
+    session = object_session(target)
+    if session is not None and target.id is not None:
+        session.info.setdefault('stale_sitemaps', set()).add(f'{kind}-{target.id // SITEMAP_CHUNK_SIZE}.xml')
+
+@event.listens_for(Accessory, 'after_insert')
+@event.listens_for(Accessory, 'after_update')
+@event.listens_for(Accessory, 'after_delete')
+def accessory_sitemap_changed(mapper, connection, target):
+    mark_sitemap_stale('items', target)
+
+@event.listens_for(BlogPost, 'after_insert')
+@event.listens_for(BlogPost, 'after_update')
+@event.listens_for(BlogPost, 'after_delete')
+def blog_sitemap_changed(mapper, connection, target):
+    mark_sitemap_stale('blog', target)
+
+@event.listens_for(db.session, 'after_commit')
+def remove_stale_sitemaps(session):
+    stale = session.info.pop('stale_sitemaps', None)
+    if not stale:
+        return
+    for name in stale | {'index.xml'}:
+        try:
+            os.remove(os.path.join(SITEMAP_FOLDER, name))
+        except FileNotFoundError:
+            pass
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_stale_sitemaps(session, previous_transaction):
+    session.info.pop('stale_sitemaps', None)
+
+# Blog generation calls go through one keep-alive session per process, which
+# retries 429 and 5xx responses with exponential backoff (honouring
+# Retry-After) before the callers see an error.
+BLOG_GENERATION_WORKERS = int(os.getenv('BLOG_GENERATION_WORKERS', '4'))
+LLM_HTTP_RETRIES = int(os.getenv('LLM_HTTP_RETRIES', '4'))
+_llm_http_session = None
+_llm_http_session_lock = threading.Lock()
+
+def llm_http_session():
+    global _llm_http_session
+    with _llm_http_session_lock:
+        if _llm_http_session is None:
+            retry = Retry(total=LLM_HTTP_RETRIES, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=max(BLOG_GENERATION_WORKERS, 1))
+            http = requests.Session()
+            http.mount('https://', adapter)
+            http.mount('http://', adapter)
+            _llm_http_session = http
+        return _llm_http_session
+
+# LLM responses are cached on disk in SQLite, keyed by a hash of the endpoint
+# (without the API key) and the request body, so retries and repeated
+# triggers within LLM_CACHE_TTL_SECONDS do not pay for the same prompt twice.
+# Least recently used entries are evicted once the cache passes
+# LLM_CACHE_MAX_BYTES. GEMINI_BASE_URL and PERPLEXITY_BASE_URL can point the
+# calls elsewhere, e.g. at fake_llm_server.py for offline runs.
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com').rstrip('/')
+PERPLEXITY_BASE_URL = os.getenv('PERPLEXITY_BASE_URL', 'https://api.perplexity.ai').rstrip('/')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(instance_path, 'llm_cache.db'))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(12 * 60 * 60)))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+
+class LLMCache:
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)')
+
+    def _connect(self):
+        # A connection per call keeps this safe to use from the generation threads
+        return contextlib.closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    @staticmethod
+    def key(url, payload):
+        return hashlib.sha256(json.dumps({'url': url, 'payload': payload}, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key, ttl=None):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?',
+                               (key, now - (self.ttl if ttl is None else ttl))).fetchone()
+            if row:
+                conn.execute('UPDATE llm_cache SET last_used = ? WHERE key = ?', (now, key))
+        if row:
+            self.hits += 1
+            return json.loads(row[0])
+        self.misses += 1
+        return None
+
+    def put(self, key, model, response):
+        if not self.enabled:
+            return
+        body = json.dumps(response)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, last_used) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (key, model, body, len(body), now, now))
+            conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+            if total > self.max_bytes:
+                evict, freed = [], 0
+                for old_key, size in conn.execute('SELECT key, size FROM llm_cache ORDER BY last_used'):
+                    if total - freed <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    freed += size
+                conn.executemany('DELETE FROM llm_cache WHERE key = ?', evict)
+
+llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_BYTES)
+
+def llm_post_json(url, model, payload, headers=None, params=None, timeout=60, ttl=None):
+    """POST payload to an LLM endpoint and return the decoded JSON, from the
+    cache when possible. params (the API key) are not part of the cache key."""
+    key = LLMCache.key(url, payload)
+    cached = llm_cache.get(key, ttl)
+    if cached is not None:
+        return cached
+    response = llm_http_session().post(url, headers=headers, params=params, json=payload, timeout=timeout)
+    response.raise_for_status()
+    result = response.json()
+    llm_cache.put(key, model, result)
+    return result
 
 def get_google_trends(n=5):
     try:
@@ -2269,7 +5197,7 @@ def get_google_trends(n=5):
         return []
 
 def get_perplexity_blog(topic, api_key, num_sources=2):
-    url = 'https://api.perplexity.ai/chat/completions'
+    url = f'{PERPLEXITY_BASE_URL}/chat/completions'
     prompt = (
         f"Write a short, SEO-friendly blog article about '{topic}' using 2-3 trusted sources. Include a references section at the end."
     )
@@ -2284,9 +5212,7 @@ def get_perplexity_blog(topic, api_key, num_sources=2):
         ]
     }
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        result = llm_post_json(url, data['model'], data, headers=headers, timeout=60)
         content = result['choices'][0]['message']['content']
         # Try to extract links from the references section
         links = []
@@ -2300,7 +5226,7 @@ def get_perplexity_blog(topic, api_key, num_sources=2):
         return None, []
 
 def get_gemini_blog(topic, api_key):
-    url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent'
+    url = f'{GEMINI_BASE_URL}/v1beta/models/gemini-pro:generateContent'
     prompt = (
         f"Write a concise, SEO-friendly blog article about '{topic}'. Include headers, a short intro, and a references section at the end."
     )
@@ -2313,9 +5239,7 @@ def get_gemini_blog(topic, api_key):
         ]
     }
     try:
-        response = requests.post(f"{url}?key={api_key}", headers=headers, json=data, timeout=120)
-        response.raise_for_status()
-        result = response.json()
+        result = llm_post_json(url, 'gemini-pro', data, headers=headers, params={'key': api_key}, timeout=120)
         content = result['candidates'][0]['content']['parts'][0]['text']
         # Try to extract links from the references section
         links = []
@@ -2329,7 +5253,7 @@ def get_gemini_blog(topic, api_key):
         return None, []
 
 def get_gemini_trending_topics(api_key, n=4):
-    url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent'
+    url = f'{GEMINI_BASE_URL}/v1beta/models/gemini-1.5-flash:generateContent'
     prompt = f'''
 List the top {n} trending topics in India today for a general audience. 
 Return only the topic titles as a plain list. It can be related to any topics like news, tech, entertainment, finance, sports, or health. and specifically for SEO
@@ -2343,9 +5267,9 @@ Return only the topic titles as a plain list. It can be related to any topics li
         ]
     }
     try:
-        response = requests.post(f"{url}?key={api_key}", headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        # Topics change through the day, so they are reused for a shorter time
+        result = llm_post_json(url, 'gemini-1.5-flash', data, headers=headers, params={'key': api_key}, timeout=60,
+                               ttl=min(LLM_CACHE_TTL_SECONDS, 3 * 60 * 60))
         text = result['candidates'][0]['content']['parts'][0]['text']
         # Split into lines and clean up
         topics = [line.strip('-•. 1234567890') for line in text.split('\n') if line.strip()]
@@ -2356,8 +5280,9 @@ Return only the topic titles as a plain list. It can be related to any topics li
             print(f"Gemini API response: {e.response.text}")
         return []
 
-def get_gemini_blog_content(topic, api_key):
-    url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent'
+def fetch_gemini_blog_content(topic, api_key):
+    """Like get_gemini_blog_content, but raises instead of returning (None, [])."""
+    url = f'{GEMINI_BASE_URL}/v1beta/models/gemini-1.5-flash:generateContent'
     prompt = f'''
  for the topic: "{topic}", write a short, SEO-friendly blog article. The blog must include:
 
@@ -2380,45 +5305,67 @@ Maintain a friendly, informative tone. Ensure the language is simple and engagin
             {"parts": [{"text": prompt}]}
         ]
     }
+    result = llm_post_json(url, 'gemini-1.5-flash', data, headers=headers, params={'key': api_key}, timeout=60)
+    content = result['candidates'][0]['content']['parts'][0]['text']
+    # Try to extract links from the references section
+    links = []
+    if 'http' in content:
+        links = [line for line in content.split('\n') if 'http' in line]
+    return content, links
+
+def get_gemini_blog_content(topic, api_key):
     try:
-        response = requests.post(f"{url}?key={api_key}", headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        content = result['candidates'][0]['content']['parts'][0]['text']
-        # Try to extract links from the references section
-        links = []
-        if 'http' in content:
-            links = [line for line in content.split('\n') if 'http' in line]
-        return content, links
+        return fetch_gemini_blog_content(topic, api_key)
     except Exception as e:
         print(f"Gemini blog content error: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Gemini API response: {e.response.text}")
         return None, []
 
-def ai_generate_blogs():
+
+def ai_generate_blogs(progress=None):
+    """Generate draft posts for today's trending topics. progress, when given,
+    is a JobProgress that receives a status for each topic. Returns a summary."""
     gemini_api_key = os.getenv('GEMINI_API_KEY')
     if not gemini_api_key:
-        print("Gemini API key not set in environment.")
-        return
+        raise RuntimeError("Gemini API key not set in environment.")
     topics = get_gemini_trending_topics(gemini_api_key, n=4)
     if not topics:
-        print("No topics found from Gemini.")
-        try:
-            flash('Failed to fetch trending topics. Please try again later.', 'danger')
-        except:
-            pass
-        return
+        raise RuntimeError("No topics found from Gemini.")
+    report = progress.update if progress else (lambda step, status, error=None: None)
+    # Avoid duplicate blogs for the same topic, within this run and across runs
+    wanted = {}
     for topic in topics:
-        # Avoid duplicate blogs for the same topic
-        slug = slugify(topic)
-        if BlogPost.query.filter_by(slug=slug).first():
-            continue
-        # content, links = get_perplexity_blog(topic, perplexity_api_key)  # Perplexity commented out
-        content, links = get_gemini_blog_content(topic, gemini_api_key)
-        if not content:
-            continue
-        blog = BlogPost(
+        wanted.setdefault(slugify(topic), topic)
+    existing = {slug for (slug,) in db.session.query(BlogPost.slug).filter(BlogPost.slug.in_(list(wanted)))}
+    todo = []
+    for slug, topic in wanted.items():
+        if slug in existing:
+            report(topic, 'skipped', 'A blog with this slug already exists.')
+        else:
+            report(topic, 'pending')
+            todo.append((slug, topic))
+    if not todo:
+        print("All trending topics already have blogs.")
+        return "All trending topics already have blogs."
+
+    def generate(item):
+        slug, topic = item
+        report(topic, 'generating')
+        try:
+            # content, links = get_perplexity_blog(topic, perplexity_api_key)  # Perplexity commented out
+            return fetch_gemini_blog_content(topic, gemini_api_key)
+        except Exception as e:
+            detail = e.response.text[:500] if getattr(e, 'response', None) is not None else ''
+            print(f"Gemini blog content error for {topic}: {e}")
+            report(topic, 'failed', f"{e} {detail}".strip())
+            return None, []
+
+    # Worker threads only make HTTP calls; rows are written here in one go
+    with ThreadPoolExecutor(max_workers=min(BLOG_GENERATION_WORKERS, len(todo))) as pool:
+        results = list(pool.map(generate, todo))
+    blogs = [
+        BlogPost(
             title=topic,
             slug=slug,
             content=content,
@@ -2429,25 +5376,286 @@ def ai_generate_blogs():
             source_links=json.dumps(links),
             ai_generated=True
         )
-        db.session.add(blog)
+        for (slug, topic), (content, links) in zip(todo, results) if content
+    ]
+    if not blogs:
+        raise RuntimeError("Gemini returned no blog content.")
+    try:
+        db.session.add_all(blogs)
         db.session.commit()
-        notify_admin_new_draft(blog)
-    print("AI blog generation complete.")
+    except Exception:
+        db.session.rollback()
+        for blog in blogs:
+            report(blog.title, 'failed', 'Could not save the draft.')
+        raise
+    for blog in blogs:
+        report(blog.title, 'saved')
+    notify_admin_new_drafts(blogs)
+    summary = f"AI blog generation complete: {len(blogs)} draft(s) saved."
+    print(summary)
+    return summary
+
+@app.cli.command('benchmark-blog-generation')
+@click.option('--runs', default=2, show_default=True, help='Number of times to run the pipeline.')
+@click.option('--no-cache', is_flag=True, help='Bypass the LLM response cache.')
+def benchmark_blog_generation(runs, no_cache):
+    """Time topic and content generation without saving drafts.
+
+    Start fake_llm_server.py and set GEMINI_BASE_URL to its address to run
+    this offline."""
+    api_key = os.getenv('GEMINI_API_KEY', 'offline')
+    llm_cache.enabled = not no_cache
+    for run in range(1, runs + 1):
+        hits, misses = llm_cache.hits, llm_cache.misses
+        started = time.perf_counter()
+        topics = get_gemini_trending_topics(api_key, n=4)
+        topics_done = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(min(BLOG_GENERATION_WORKERS, len(topics)), 1)) as pool:
+            contents = list(pool.map(lambda topic: get_gemini_blog_content(topic, api_key)[0], topics))
+        finished = time.perf_counter()
+        click.echo(f"Run {run}: {len(topics)} topic(s) in {(topics_done - started) * 1000:.0f} ms, "
+                   f"{sum(1 for c in contents if c)} post(s) in {(finished - topics_done) * 1000:.0f} ms, "
+                   f"total {(finished - started) * 1000:.0f} ms; cache {llm_cache.hits - hits} hit(s), "
+                   f"{llm_cache.misses - misses} miss(es)")
+
+# Background jobs.
+# Long admin actions run on a daemon thread and record their state in
+# job_run, so any worker can answer /admin/jobs/<id>. Only one run of a kind
+# is in flight at a time; a run that has not finished after
+# JOB_STALE_SECONDS is assumed to have died with its worker.
+JOB_STALE_SECONDS = 30 * 60
+
+class JobProgress:
+    """Per-step status for a JobRun, safe to update from several threads."""
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.steps = {}
+        self._lock = threading.Lock()
+
+    def update(self, step, status, error=None):
+        with self._lock:
+            self.steps[step] = {'status': status, 'error': error} if error else {'status': status}
+            payload = json.dumps(self.steps)
+            with app.app_context():
+                JobRun.query.filter_by(id=self.job_id).update({'progress': payload}, synchronize_session=False)
+                db.session.commit()
 
-# Schedule AI blog generation every 24 hours
-scheduler = BackgroundScheduler()
-scheduler.add_job(ai_generate_blogs, 'interval', hours=24, id='ai_blog_generation')
-scheduler.start()
+def finish_job(job_id, **values):
+    JobRun.query.filter_by(id=job_id).update(dict(values, finished_at=datetime.utcnow()), synchronize_session=False)
+    db.session.commit()
+
+def run_job(job_id, target):
+    with app.app_context():
+        JobRun.query.filter_by(id=job_id).update({'status': 'running', 'started_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        try:
+            result = target(JobProgress(job_id))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Job {job_id} failed: {str(e)}")
+            finish_job(job_id, status='failed', error=str(e))
+        else:
+            finish_job(job_id, status='succeeded', result=result)
+        finally:
+            db.session.remove()
+
+def enqueue_job(kind, target, user_id=None):
+    """Start target(progress) in the background unless a run of this kind is
+    already in flight. Returns (job, created)."""
+    in_flight = JobRun.query.filter(JobRun.kind == kind, JobRun.status.in_(('queued', 'running')))
+    stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    in_flight.filter(JobRun.created_at < stale_before).update(
+        {'status': 'failed', 'error': 'Interrupted before it finished.', 'finished_at': datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    running = in_flight.first()
+    if running:
+        return running, False
+    job = JobRun(kind=kind, status='queued', created_by=user_id)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker queued the same kind at the same moment; the unique
+        # index on in-flight runs let only one of the inserts through
+        db.session.rollback()
+        running = in_flight.first()
+        if running is None:
+            # ...and it has already finished
+            return enqueue_job(kind, target, user_id)
+        return running, False
+    threading.Thread(target=run_job, args=(job.id, target), daemon=True).start()
+    return job, True
+
+# Scheduled jobs.
+# Exactly one process runs the scheduler. With SCHEDULER_MODE=auto every web
+# worker competes for a lock (a Postgres advisory lock, or a file lock on
+# other databases) and only the holder starts it; the others retry every
+# SCHEDULER_RETRY_SECONDS and take over if the leader goes away. With
+# SCHEDULER_MODE=off the web workers run no scheduler threads and
+# `python scheduler.py` runs the same election in its own process. Job
+# definitions and next run times live in the apscheduler_jobs table, so a
+# restart does not reset the schedule.
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'auto')
+SCHEDULER_LOCK_KEY = 7254001
+SCHEDULER_LOCK_FILE = os.path.join(instance_path, 'scheduler.lock')
+SCHEDULER_RETRY_SECONDS = int(os.getenv('SCHEDULER_RETRY_SECONDS', '60'))
+# id -> (textual reference to the job function, trigger arguments)
+SCHEDULED_JOBS = {
+    'ai_blog_generation': ('app:scheduled_ai_generate_blogs', {'trigger': 'interval', 'hours': 24}),
+    'weekly_swap_events': ('app:schedule_weekly_swap_events', {'trigger': 'interval', 'minutes': SWAP_EVENT_CHECK_MINUTES}),
+}
+scheduler = None  # The running BackgroundScheduler, in the leader only
+
+class AdvisoryLock:
+    """Session-level Postgres advisory lock held on a dedicated connection."""
+    def __init__(self, engine, key):
+        self.engine = engine
+        self.key = key
+        self.connection = None
+
+    def acquire(self):
+        connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            if connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}).scalar():
+                self.connection = connection
+                return True
+        except Exception as e:
+            app.logger.error(f"Scheduler lock check failed: {str(e)}")
+        connection.close()
+        return False
+
+    def held(self):
+        try:
+            self.connection.execute(text('SELECT 1'))
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self.connection is not None:
+            # Drop the DBAPI connection rather than pooling it, which is what
+            # actually releases a session-level lock
+            self.connection.invalidate()
+            self.connection.close()
+            self.connection = None
+
+class FileLock:
+    """flock() on a file in instance/; covers workers on a single host."""
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self):
+        import fcntl
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self.handle = handle
+        return True
+
+    def held(self):
+        return self.handle is not None
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+def create_scheduler_lock(engine):
+    if engine.dialect.name == 'postgresql':
+        return AdvisoryLock(engine, SCHEDULER_LOCK_KEY)
+    return FileLock(SCHEDULER_LOCK_FILE)
+
+def start_leader_scheduler(engine):
+    leader = BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(engine=engine)},
+        job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 3600},
+    )
+    # Start paused so stored jobs are visible before the missing ones are added
+    leader.start(paused=True)
+    for job_id, (func, trigger_args) in SCHEDULED_JOBS.items():
+        if leader.get_job(job_id) is None:
+            leader.add_job(func, id=job_id, **trigger_args)
+    leader.resume()
+    return leader
+
+def run_scheduler_election():
+    """Loop forever, running the scheduler whenever this process holds the lock."""
+    global scheduler
+    with app.app_context():
+        engine = db.engine
+    lock = create_scheduler_lock(engine)
+    while True:
+        try:
+            if scheduler is None and lock.acquire():
+                scheduler = start_leader_scheduler(engine)
+                print(f"Scheduler started in process {os.getpid()}.")
+            elif scheduler is not None and not lock.held():
+                scheduler.shutdown(wait=False)
+                scheduler = None
+                print(f"Scheduler lock lost in process {os.getpid()}; stopped.")
+        except Exception as e:
+            app.logger.error(f"Scheduler election failed: {str(e)}")
+        time.sleep(SCHEDULER_RETRY_SECONDS)
+
+def start_scheduler_election():
+    threading.Thread(target=run_scheduler_election, name='scheduler-election', daemon=True).start()
+
+def scheduled_ai_generate_blogs():
+    # Goes through the job table so it is de-duplicated against manual runs
+    with app.app_context():
+        enqueue_job('ai_blog_generation', ai_generate_blogs)
+
+if SCHEDULER_MODE == 'auto':
+    start_scheduler_election()
 
 @app.route('/admin/generate-blog', methods=['POST'])
 @login_required
+@rate_limit(3, 3600)
 def admin_generate_blog():
     if current_user.role != 'admin':
         flash('Access denied.', 'danger')
         return redirect(url_for('admin_dashboard'))
-    ai_generate_blogs()
-    flash('AI blog generation triggered. Drafts will appear in the blog dashboard shortly.', 'success')
+    job, created = enqueue_job('ai_blog_generation', ai_generate_blogs, current_user.id)
+    if wants_json_response():
+        return jsonify({'job': job.to_dict(), 'created': created, 'status_url': url_for('admin_job', job_id=job.id)}), 202
+    if created:
+        flash(f'AI blog generation started (job #{job.id}). Drafts will appear in the blog dashboard shortly.', 'success')
+    else:
+        flash(f'AI blog generation is already running (job #{job.id}).', 'info')
     return redirect(url_for('admin_blogs'))
 
+@app.route('/admin/jobs/<int:job_id>')
+@login_required
+def admin_job(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied.'}), 403
+    job = db.session.get(JobRun, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job.to_dict())
+
+def warm_templates():
+    """Compile every template up front so the first requests after boot don't pay for it"""
+    if not os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        return
+    started = time.perf_counter()
+    compiled = 0
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            app.logger.error(f"Failed to compile template {name}: {str(e)}")
+    app.logger.info(f"Compiled {compiled} templates in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+# Runs at import, so each gunicorn worker is warm before it accepts traffic
+warm_templates()
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,85 @@
+"""Offline stand-in for the Gemini and Perplexity APIs used by blog generation.
+
+    python fake_llm_server.py --port 8765 --latency 1.5
+    GEMINI_BASE_URL=http://127.0.0.1:8765 PERPLEXITY_BASE_URL=http://127.0.0.1:8765 \\
+        flask --app app benchmark-blog-generation
+
+Answers generateContent and chat/completions requests with canned text after
+--latency seconds, and fails --fail-rate of them with a 503 so the retry
+path can be exercised.
+"""
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOPICS = [
+    'Monsoon Travel Essentials', 'Budget Laptops for Students', 'Festive Season Decor Ideas',
+    'Home Workout Equipment', 'Sustainable Fashion Swaps', 'Camping Gear for Beginners',
+    'Smartphone Photography Tips', 'Renting vs Buying Electronics',
+]
+
+
+def fake_text(prompt):
+    wanted = re.search(r'top (\d+) trending topics', prompt)
+    if wanted:
+        return '\n'.join(f'{i}. {topic}' for i, topic in enumerate(TOPICS[:int(wanted.group(1))], 1))
+    topic = re.search(r'["“\'](.+?)["”\']', prompt)
+    topic = topic.group(1) if topic else 'Sharing Economy'
+    return (
+        f'# {topic}: What You Need to Know\n\n'
+        f'{topic} matters more than ever. Here is a quick guide.\n\n'
+        f'## Key Points\n\n- Plan ahead\n- Borrow before you buy\n- Share with your community\n\n'
+        f'## Conclusion\n\nStart small and keep it simple.\n\n'
+        f'## References\n\n- https://example.com/{re.sub(r"[^a-z0-9]+", "-", topic.lower())}\n\n'
+        f'Meta description: A short guide to {topic.lower()}.\n\n'
+        f'Keywords: {topic.lower()}, sharing, community, tips, guide'
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            return self.reply(503, {'error': {'code': 503, 'message': 'Simulated overload'}})
+        if self.path.split('?')[0].endswith(':generateContent'):
+            prompt = body['contents'][0]['parts'][0]['text']
+            return self.reply(200, {'candidates': [{'content': {'parts': [{'text': fake_text(prompt)}], 'role': 'model'}}]})
+        if self.path.split('?')[0].endswith('/chat/completions'):
+            prompt = body['messages'][-1]['content']
+            return self.reply(200, {'choices': [{'message': {'role': 'assistant', 'content': fake_text(prompt)}}]})
+        self.reply(404, {'error': {'code': 404, 'message': f'Unknown endpoint {self.path}'}})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 503:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f'{self.command} {self.path.split("?")[0]} {args[1] if len(args) > 1 else ""}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=1.0, help='Seconds to wait before each response.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    args = parser.parse_args()
+    Handler.latency = args.latency
+    Handler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'Fake LLM server on http://{args.host}:{args.port} (latency {args.latency}s, fail rate {args.fail_rate})')
+    server.serve_forever()
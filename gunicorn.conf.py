@@ -0,0 +1,11 @@
+# Gunicorn settings (loaded from the working directory by default)
+worker_class = 'gevent'
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    # psycopg2 waits for Postgres inside C code, which would block the gevent
+    # hub and stall every other request and SSE stream on the worker. Route
+    # those waits through gevent instead.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -0,0 +1,14 @@
+"""Run scheduled jobs in their own process.
+
+Set SCHEDULER_MODE=off on the web service so its workers start no scheduler
+threads, then run `python scheduler.py` as a separate worker. Several copies
+are safe: only the one holding the scheduler lock runs jobs.
+"""
+import os
+
+os.environ['SCHEDULER_MODE'] = 'off'
+
+from app import run_scheduler_election
+
+if __name__ == "__main__":
+    run_scheduler_election()
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# app.py connects and creates its tables at import, so point it at a
+# throwaway SQLite database and instance folder (sitemaps, caches, logs,
+# locks) and keep the scheduler out of the test process
+_db_dir = tempfile.mkdtemp(prefix='antlers-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['INSTANCE_PATH'] = os.path.join(_db_dir, 'instance')
+os.environ['SCHEDULER_MODE'] = 'off'
+os.environ.setdefault('RATE_LIMIT_STORE', 'memory')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as antlers  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    antlers.app.config['TESTING'] = True
+    return antlers
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def s3(app_module, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='antlers-test')
+        yield app_module.S3Storage('antlers-test', region='us-east-1')
@@ -0,0 +1,86 @@
+import pytest
+
+
+@pytest.fixture
+def borrow(app_module):
+    db = app_module.db
+    with app_module.app.app_context():
+        lender = app_module.User(username='chat-lender', password='pw', email='chat-lender@example.com')
+        borrower = app_module.User(username='chat-borrower', password='pw', email='chat-borrower@example.com')
+        db.session.add_all([lender, borrower])
+        db.session.flush()
+        borrow = app_module.BorrowedAccessory(borrower_id=borrower.id, lender_id=lender.id, status='approved',
+                                              residence='Hall 1', message='hello')
+        db.session.add(borrow)
+        db.session.commit()
+        ids = borrow.id, borrower.id, lender.id
+    yield ids
+    with app_module.app.app_context():
+        app_module.ChatMessage.query.filter_by(borrow_id=ids[0]).delete()
+        app_module.UnreadCounter.query.filter_by(thread_type='borrow', thread_id=ids[0]).delete()
+        app_module.BorrowedAccessory.query.filter_by(id=ids[0]).delete()
+        app_module.User.query.filter(app_module.User.id.in_(ids[1:])).delete()
+        db.session.commit()
+
+
+def test_insert_event_carries_database_timestamp(app_module, borrow):
+    borrow_id, borrower_id, lender_id = borrow
+    with app_module.app.app_context():
+        message = app_module.ChatMessage(borrow_id=borrow_id, sender_id=borrower_id, recipient_id=lender_id,
+                                         message='hi')
+        app_module.db.session.add(message)
+        app_module.db.session.flush()
+        (channel, payload), = app_module.db.session.info['pending_events']
+        assert channel == f'chat:{borrow_id}'
+        assert payload['timestamp'] == message.timestamp.isoformat()
+        app_module.db.session.rollback()
+
+
+def test_truncated_chat_event_is_reloaded_or_skipped(app_module, borrow):
+    borrow_id, borrower_id, lender_id = borrow
+    with app_module.app.app_context():
+        message = app_module.ChatMessage(borrow_id=borrow_id, sender_id=borrower_id, recipient_id=lender_id,
+                                         message='x' * 9000)
+        app_module.db.session.add(message)
+        app_module.db.session.commit()
+        message_id = message.id
+    broker = app_module.PostgresBroker()
+    truncated = {'id': message_id, 'borrow_id': borrow_id, 'message': None, 'truncated': True}
+    assert broker._complete(f'chat:{borrow_id}', truncated)['message'] == 'x' * 9000
+    assert broker._complete(f'chat:{borrow_id}', dict(truncated, id=message_id + 1000)) is None
+
+
+def test_truncated_room_event_is_reloaded(app_module):
+    with app_module.app.app_context():
+        user = app_module.User(username='room-poster', password='pw', email='room-poster@example.com')
+        app_module.db.session.add(user)
+        app_module.db.session.flush()
+        row = app_module.CommunityChatMessage(user_id=user.id, message='y' * 9000)
+        app_module.db.session.add(row)
+        app_module.db.session.flush()
+        (channel, payload), = app_module.db.session.info['pending_events']
+        assert payload['timestamp'] == row.timestamp.isoformat()
+        app_module.db.session.commit()
+        row_id, user_id = row.id, user.id
+    broker = app_module.PostgresBroker()
+    truncated = {'type': 'message', 'room': 'community', 'id': row_id, 'message': None, 'truncated': True}
+    event = broker._complete(app_module.COMMUNITY_ROOM, truncated)
+    assert event['message'] == 'y' * 9000 and event['username'] == 'room-poster'
+    with app_module.app.app_context():
+        app_module.db.session.delete(app_module.db.session.get(app_module.CommunityChatMessage, row_id))
+        app_module.db.session.delete(app_module.db.session.get(app_module.User, user_id))
+        app_module.db.session.commit()
+
+
+def test_deleting_a_thread_drops_its_unread_counters(app_module, borrow):
+    borrow_id, borrower_id, lender_id = borrow
+    with app_module.app.app_context():
+        db = app_module.db
+        db.session.add(app_module.ChatMessage(borrow_id=borrow_id, sender_id=borrower_id, recipient_id=lender_id,
+                                              message='hi'))
+        db.session.commit()
+        assert db.session.get(app_module.UnreadCounter, (lender_id, 'borrow', borrow_id)).count == 1
+        app_module.ChatMessage.query.filter_by(borrow_id=borrow_id).delete()
+        db.session.delete(db.session.get(app_module.BorrowedAccessory, borrow_id))
+        db.session.commit()
+        assert app_module.UnreadCounter.query.filter_by(thread_type='borrow', thread_id=borrow_id).count() == 0
@@ -0,0 +1,37 @@
+import jinja2
+import pytest
+
+
+@pytest.fixture
+def item(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.app, 'jinja_loader', jinja2.DictLoader({
+        'item_detail.html': '{{ item.name }} {{ unread_message_count }}',
+    }))
+    db = app_module.db
+    with app_module.app.app_context():
+        owner = app_module.User(username='etag-owner', password='pw', email='etag-owner@example.com',
+                                 overall_verified=True)
+        db.session.add(owner)
+        db.session.flush()
+        item = app_module.Accessory(name='Kettle', slug='etag-kettle', type='lend', user_id=owner.id)
+        db.session.add(item)
+        db.session.commit()
+        slug, ids = item.slug, (item.id, owner.id)
+    yield slug
+    with app_module.app.app_context():
+        db.session.delete(db.session.get(app_module.Accessory, ids[0]))
+        db.session.delete(db.session.get(app_module.User, ids[1]))
+        db.session.commit()
+
+
+def test_anonymous_item_page_answers_304(client, item):
+    etag = client.get(f'/item/{item}').headers['ETag']
+    assert client.get(f'/item/{item}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_signed_in_item_page_is_always_rendered(client, item):
+    etag = client.get(f'/item/{item}').headers['ETag']
+    client.post('/login', data={'username': 'etag-owner', 'password': 'pw'})
+    response = client.get(f'/item/{item}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
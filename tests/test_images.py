@@ -0,0 +1,45 @@
+import io
+from concurrent.futures import Future
+
+from PIL import Image
+
+
+def test_image_column_points_at_downscaled_copy(app_module, tmp_path, monkeypatch):
+    local = app_module.LocalStorage(str(tmp_path / 'static'))
+    monkeypatch.setattr(app_module, 'storage', local)
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    Image.new('RGB', (3000, 2000), (10, 20, 30)).save(work_dir / 'source', 'JPEG')
+    original = app_module.content_address('f' * 64, 'jpg')
+    local.put_file(original, str(work_dir / 'source'))
+
+    db = app_module.db
+    with app_module.app.app_context():
+        owner = app_module.User(username='image-owner', password='pw', email='image-owner@example.com')
+        db.session.add(owner)
+        db.session.flush()
+        first = app_module.Accessory(name='Lamp', type='lend', image=original, user_id=owner.id)
+        db.session.add(first)
+        db.session.commit()
+
+        future = Future()
+        future.set_result(app_module.process_image(str(work_dir / 'source'), str(work_dir), original))
+        app_module.record_renditions(original, str(work_dir), future)
+        db.session.refresh(first)
+        assert first.image != original
+        assert app_module.CONTENT_ADDRESSED_PATH.match(first.image)
+        with local.open(first.image) as stored:
+            assert Image.open(stored).width == app_module.IMAGE_MAX_WIDTH
+
+        # A later upload of the same content reuses the copy without reprocessing
+        second = app_module.Accessory(name='Lamp again', type='lend', image=original, user_id=owner.id)
+        db.session.add(second)
+        db.session.commit()
+        assert app_module.share_existing_renditions(original)
+        db.session.refresh(second)
+        assert (second.image, second.image_renditions) == (first.image, first.image_renditions)
+
+        db.session.delete(first)
+        db.session.delete(second)
+        db.session.delete(owner)
+        db.session.commit()
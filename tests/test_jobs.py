@@ -0,0 +1,30 @@
+import threading
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+def test_only_one_run_of_a_kind_in_flight(app_module):
+    JobRun, db = app_module.JobRun, app_module.db
+    with app_module.app.app_context():
+        db.session.add(JobRun(kind='test_unique', status='running'))
+        db.session.commit()
+        db.session.add(JobRun(kind='test_unique', status='queued'))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+        # Finished runs don't count
+        db.session.add(JobRun(kind='test_unique', status='succeeded'))
+        db.session.commit()
+
+
+def test_enqueue_job_returns_the_run_in_flight(app_module):
+    JobRun, db = app_module.JobRun, app_module.db
+    started = threading.Event()
+    with app_module.app.app_context():
+        db.session.add(JobRun(kind='test_enqueue', status='running'))
+        db.session.commit()
+        job, created = app_module.enqueue_job('test_enqueue', lambda progress: started.set())
+        assert not created
+        assert job.status == 'running'
+    assert not started.wait(0.2)
@@ -0,0 +1,70 @@
+import json
+
+
+def owner_id(app_module):
+    return app_module.User.query.filter_by(username='admin').first().id
+
+
+def test_no_json_ld_stored_without_a_base_url(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITE_URL', '')
+    with app_module.app.app_context():
+        item = app_module.Accessory(name='Camera', slug='camera-no-base', type='lend', user_id=owner_id(app_module))
+        app_module.db.session.add(item)
+        app_module.db.session.commit()
+        assert item.json_ld is None
+
+        # The page builds it from the host it was requested on
+        with app_module.app.test_request_context(base_url='https://antlers.example'):
+            script = str(app_module.json_ld_script(item))
+        assert '"url": "https://antlers.example/item/camera-no-base"' in script
+        assert 'localhost' not in script
+
+
+def test_site_url_used_outside_requests(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITE_URL', 'https://antlers.example')
+    with app_module.app.app_context():
+        item = app_module.Accessory(name='Lens', slug='lens-site-url', type='lend', user_id=owner_id(app_module))
+        app_module.db.session.add(item)
+        app_module.db.session.commit()
+        assert json.loads(item.json_ld)['url'] == 'https://antlers.example/item/lens-site-url'
+
+
+def test_absolute_blog_image_passed_through(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITE_URL', 'https://antlers.example')
+    with app_module.app.app_context():
+        post = app_module.BlogPost(title='Post', slug='post-cdn-image', content='Body', author='A',
+                                   status='approved', image_url='https://cdn.example.com/p.jpg')
+        app_module.db.session.add(post)
+        app_module.db.session.commit()
+        assert json.loads(post.json_ld)['image'] == ['https://cdn.example.com/p.jpg']
+
+
+def test_s3_images_use_a_non_expiring_url(app_module, s3, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITE_URL', 'https://antlers.example')
+    monkeypatch.setattr(app_module, 'storage', s3)
+    with app_module.app.app_context():
+        item = app_module.Accessory(name='Bag', slug='bag-s3', type='lend', image='uploads/ab/cd/abcd.jpg',
+                                    user_id=owner_id(app_module))
+        app_module.db.session.add(item)
+        app_module.db.session.commit()
+        images = json.loads(item.json_ld)['image']
+    assert images == ['https://antlers.example/img/uploads/ab/cd/abcd.jpg?w=1080&fmt=jpeg']
+
+
+def test_stored_json_ld_kept_when_it_cannot_be_rebuilt(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'SITE_URL', 'https://antlers.example')
+    with app_module.app.app_context():
+        post = app_module.BlogPost(title='Kept', slug='post-kept', content='Body', author='A', status='approved')
+        app_module.db.session.add(post)
+        app_module.db.session.commit()
+        stored = post.json_ld
+
+        monkeypatch.setattr(app_module, 'SITE_URL', '')
+        post.title = 'Kept, edited offline'
+        app_module.db.session.commit()
+        assert post.json_ld == stored
+
+        monkeypatch.setattr(app_module, 'SITE_URL', 'https://antlers.example')
+        post.title = 'Kept, edited again'
+        app_module.db.session.commit()
+        assert json.loads(post.json_ld)['dateModified'] == post.updated_at.isoformat(timespec='seconds')
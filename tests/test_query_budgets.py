@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import jinja2
+import pytest
+
+THREADS = 8
+
+# Stand-ins for the real templates that touch the same relationships
+TEMPLATES = {
+    'chat_history.html': (
+        '{% for chat in active_chats %}{{ chat.borrow_request.borrower.username }} '
+        '{{ chat.borrow_request.lender.username }} {{ chat.borrow_request.accessory.name }} '
+        '{{ chat.last_message.message if chat.last_message }} {{ chat.unread_count }}\n{% endfor %}'
+    ),
+    'borrow_requests.html': (
+        '{% for r in pending_requests + active_requests %}{{ r.borrower.username }} '
+        '{{ r.lender.username }} {{ r.accessory.name }}\n{% endfor %}'
+    ),
+    'return_requests.html': (
+        '{% for r in pending_returns + approved_returns + rejected_returns %}{{ r.borrower.username }} '
+        '{{ r.lender.username }} {{ r.accessory.name }}\n{% endfor %}'
+    ),
+}
+
+
+@pytest.fixture(scope='module')
+def lender(app_module):
+    """A user lending THREADS items, each with a borrow request, chat and return"""
+    db = app_module.db
+    with app_module.app.app_context():
+        lender = app_module.User(username='budget-lender', password='pw', email='budget-lender@example.com',
+                                 overall_verified=True)
+        db.session.add(lender)
+        db.session.flush()
+        for i in range(THREADS):
+            borrower = app_module.User(username=f'budget-borrower-{i}', password='pw',
+                                       email=f'budget-borrower-{i}@example.com', overall_verified=True)
+            item = app_module.Accessory(name=f'Budget item {i}', type='lend', user_id=lender.id)
+            db.session.add_all([borrower, item])
+            db.session.flush()
+            borrow = app_module.BorrowedAccessory(accessory_id=item.id, borrower_id=borrower.id, lender_id=lender.id,
+                                                  status=('pending', 'approved', 'delivered')[i % 3],
+                                                  residence='Hostel', message='Please')
+            db.session.add(borrow)
+            db.session.flush()
+            for minute in range(3):
+                db.session.add(app_module.ChatMessage(borrow_id=borrow.id, sender_id=borrower.id,
+                                                      recipient_id=lender.id, message=f'thread {i} message {minute}',
+                                                      timestamp=datetime(2026, 1, 1, 10, minute)))
+            db.session.add(app_module.ReturnedAccessory(accessory_id=item.id, borrower_id=borrower.id,
+                                                        lender_id=lender.id, item_name=item.name,
+                                                        status=('pending', 'approved', 'rejected')[i % 3]))
+        db.session.commit()
+    return 'budget-lender'
+
+
+@pytest.fixture
+def logged_in(app_module, client, lender, monkeypatch):
+    monkeypatch.setattr(app_module.app, 'jinja_loader', jinja2.DictLoader(TEMPLATES))
+    client.post('/login', data={'username': lender, 'password': 'pw'})
+    return client
+
+
+@pytest.mark.parametrize('path, budget', [
+    ('/chat_history', 4),
+    ('/borrow_requests', 3),
+    ('/return_requests', 2),
+])
+def test_page_stays_within_query_budget(app_module, logged_in, path, budget):
+    with app_module.max_queries(budget):
+        response = logged_in.get(path)
+    assert response.status_code == 200
+    assert response.data.count(b'budget-borrower-') == THREADS
+
+
+def test_chat_history_shows_latest_message(app_module, logged_in):
+    body = logged_in.get('/chat_history').get_data(as_text=True)
+    for i in range(THREADS):
+        assert f'thread {i} message 2' in body
+        assert f'thread {i} message 1' not in body
+
+
+def test_max_queries_reports_the_repeated_statement(app_module):
+    with app_module.app.app_context():
+        with pytest.raises(AssertionError, match=r'3 queries run, budget is 2:\n  3 x SELECT'):
+            with app_module.max_queries(2):
+                for user_id in range(3):
+                    app_module.db.session.get(app_module.User, user_id + 1000)
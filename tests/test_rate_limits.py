@@ -0,0 +1,17 @@
+def test_memory_store_drops_buckets_once_refilled(app_module):
+    store = app_module.MemoryRateLimitStore()
+    assert store.take('slow', 2, 0.1, 0) == 1
+    assert store.take('fast', 5, 1, 0) == 4
+    assert store.take('fast', 5, 1, 0.5) == 3.5
+    # 'fast' is full again at 2.5 and 'slow' at 10, whatever limit the caller has
+    assert store.take('other', 1, 1, 3) == 0
+    assert set(store.buckets) == {'slow', 'other'}
+    assert store.take('other', 1, 1, 20) == 0
+    assert set(store.buckets) == {'other'}
+    assert len(store.expiry) == 1
+
+
+def test_memory_store_limits_within_the_window(app_module):
+    store = app_module.MemoryRateLimitStore()
+    assert [store.take('k', 2, 2 / 60, 0) for _ in range(3)] == [1, 0, -1]
+    assert store.take('k', 2, 2 / 60, 30) == 0
@@ -0,0 +1,29 @@
+import os
+import time
+
+
+def test_sitemap_rebuilt_once_older_than_max_age(app_module, client):
+    db, Accessory = app_module.db, app_module.Accessory
+    with app_module.app.app_context():
+        owner = app_module.User.query.filter_by(username='admin').first()
+        item = Accessory(name='Tent', slug='tent-before', is_available=True, type='lend', user_id=owner.id)
+        db.session.add(item)
+        db.session.commit()
+        name = f'items-{item.id // app_module.SITEMAP_CHUNK_SIZE}.xml'
+    assert b'tent-before' in client.get(f'/sitemaps/{name}').data
+
+    # Bulk updates skip the mapper events, so the cached file is not removed
+    with app_module.app.app_context():
+        Accessory.query.filter_by(slug='tent-before').update({'slug': 'tent-after'}, synchronize_session=False)
+        db.session.commit()
+    assert b'tent-before' in client.get(f'/sitemaps/{name}').data
+
+    path = os.path.join(app_module.SITEMAP_FOLDER, name)
+    stale = time.time() - app_module.SITEMAP_MAX_AGE - 1
+    os.utime(path, (stale, stale))
+    assert b'tent-after' in client.get(f'/sitemaps/{name}').data
+
+
+def test_sitemap_chunk_without_rows_is_not_found(app_module, client):
+    assert client.get('/sitemaps/items-999999.xml').status_code == 404
+    assert not os.path.exists(os.path.join(app_module.SITEMAP_FOLDER, 'items-999999.xml'))
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.mark.parametrize('statement, safe', [
+    ('SELECT accessory.id FROM accessory WHERE accessory.id = %(id_1)s', True),
+    ('select count(*) from "user"', True),
+    ("SELECT pg_notify(%(channel)s, %(payload)s)", False),
+    ('SELECT pg_try_advisory_lock(%(key)s)', False),
+    ('SELECT job_run.id FROM job_run FOR UPDATE', False),
+    ('SELECT nextval(\'job_run_id_seq\') FROM job_run', False),
+    ('WITH moved AS (DELETE FROM job_run RETURNING *) SELECT * FROM moved', False),
+    ('UPDATE accessory SET name = %(name)s', False),
+])
+def test_analyze_only_plain_reads(app_module, statement, safe):
+    assert app_module.analyze_safe(statement) is safe
+
+
+class RecordingCursor:
+    def __init__(self, log, fail_on):
+        self.log = log
+        self.fail_on = fail_on
+
+    def execute(self, sql, parameters=None):
+        self.log.append(sql)
+        if sql.startswith(self.fail_on):
+            raise RuntimeError('boom')
+
+    def fetchall(self):
+        return [('Seq Scan on accessory',)]
+
+    def close(self):
+        pass
+
+
+def fake_postgres(fail_on='never'):
+    log = []
+    dbapi_connection = SimpleNamespace(autocommit=False, cursor=lambda: RecordingCursor(log, fail_on))
+    conn = SimpleNamespace(dialect=SimpleNamespace(name='postgresql'))
+    return conn, SimpleNamespace(connection=dbapi_connection), log
+
+
+def test_explain_runs_inside_a_savepoint(app_module):
+    conn, cursor, log = fake_postgres()
+    plan = app_module.explain_statement(conn, cursor, 'SELECT 1 FROM accessory', {}, analyze=False)
+    assert plan == 'Seq Scan on accessory'
+    assert log == ['SAVEPOINT slow_query_explain', 'EXPLAIN SELECT 1 FROM accessory',
+                   'RELEASE SAVEPOINT slow_query_explain']
+
+
+def test_failed_explain_rolls_back_to_the_savepoint(app_module):
+    conn, cursor, log = fake_postgres(fail_on='EXPLAIN')
+    with pytest.raises(RuntimeError):
+        app_module.explain_statement(conn, cursor, 'SELECT 1 FROM accessory', {}, analyze=True)
+    assert log == ['SAVEPOINT slow_query_explain', 'EXPLAIN (ANALYZE, BUFFERS) SELECT 1 FROM accessory',
+                   'ROLLBACK TO SAVEPOINT slow_query_explain', 'RELEASE SAVEPOINT slow_query_explain']
@@ -0,0 +1,48 @@
+import io
+import time
+
+
+def test_s3_put_open_exists(s3, tmp_path):
+    key = 'uploads/ab/cd/abcd.jpg'
+    assert not s3.exists(key)
+    s3.put(key, io.BytesIO(b'first'))
+    assert s3.exists(key)
+    assert s3.open(key).read() == b'first'
+
+    local = tmp_path / 'source'
+    local.write_bytes(b'second')
+    s3.put_file(key, str(local))
+    assert s3.open(key).read() == b'second'
+    assert s3.size(key) == 6
+    assert list(s3.keys()) == [key]
+
+
+def test_migrate_uploads_copies_missing_keys(app_module, s3, tmp_path, monkeypatch):
+    uploads = tmp_path / 'uploads'
+    (uploads / 'ab' / 'cd').mkdir(parents=True)
+    (uploads / 'ab' / 'cd' / 'new.jpg').write_bytes(b'new')
+    (uploads / 'ab' / 'cd' / 'old.jpg').write_bytes(b'old')
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(uploads))
+    monkeypatch.setattr(app_module, 'storage', s3)
+    s3.put('uploads/ab/cd/old.jpg', io.BytesIO(b'already there'))
+
+    result = app_module.app.test_cli_runner().invoke(args=['migrate-uploads', '--source', 'local'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Copied 1 file(s), 1 already present.' in result.output
+    assert s3.open('uploads/ab/cd/new.jpg').read() == b'new'
+    assert s3.open('uploads/ab/cd/old.jpg').read() == b'already there'
+
+
+def test_local_signed_url_honours_expires_in(app_module, client, tmp_path, monkeypatch):
+    local = app_module.LocalStorage(str(tmp_path))
+    local.put('uploads/ab/cd/file.jpg', io.BytesIO(b'data'))
+    monkeypatch.setattr(app_module, 'storage', local)
+    with app_module.app.test_request_context():
+        short = local.signed_url('uploads/ab/cd/file.jpg', expires_in=60)
+        other = local.signed_url('uploads/ab/cd/other.jpg')
+
+    assert client.get(short).data == b'data'
+    assert client.get(other.replace('other.jpg', 'file.jpg')).status_code == 403
+    monkeypatch.setattr(time, 'time', lambda real=time.time: real() + 120)
+    assert client.get(short).status_code == 403
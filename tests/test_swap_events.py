@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def no_weekly_events(app_module):
+    """Sets the seeded weekly events aside for the test and restores them after."""
+    SwapEvent, db = app_module.SwapEvent, app_module.db
+    with app_module.app.app_context():
+        saved = [(e.id, e.status) for e in SwapEvent.query.filter_by(is_weekly=True)]
+        SwapEvent.query.filter(SwapEvent.id.in_([i for i, _ in saved])).update(
+            {'is_weekly': False}, synchronize_session=False)
+        db.session.commit()
+        before = {e.id for e in SwapEvent.query}
+    yield
+    with app_module.app.app_context():
+        SwapEvent.query.filter(SwapEvent.id.notin_(before)).delete(synchronize_session=False)
+        for event_id, status in saved:
+            SwapEvent.query.filter_by(id=event_id).update({'is_weekly': True, 'status': status})
+        db.session.commit()
+
+
+def test_no_weekly_event_invented_without_a_schedule(app_module, no_weekly_events):
+    with app_module.app.app_context():
+        count = app_module.SwapEvent.query.count()
+        app_module.schedule_weekly_swap_events()
+        assert app_module.SwapEvent.query.count() == count
+
+
+def test_next_weekly_event_follows_the_latest_schedule(app_module, no_weekly_events):
+    SwapEvent, db = app_module.SwapEvent, app_module.db
+    with app_module.app.app_context():
+        past = datetime.now() - timedelta(days=3)
+        db.session.add(SwapEvent(name='Last week', description='Tuesday swap', start_date=past,
+                                 end_date=past + timedelta(hours=2), status='completed', is_weekly=True,
+                                 scheduled_day='Tuesday'))
+        db.session.commit()
+        app_module.schedule_weekly_swap_events()
+        created = SwapEvent.query.filter_by(is_weekly=True, status='pending').one()
+        assert created.start_date.strftime('%A') == 'Tuesday'
+        assert created.description == 'Tuesday swap'
+
+
+def test_trading_cycles_skip_the_requesters_own_items(app_module):
+    # One owner holds every item but two; each of those two can only trade with it
+    items = [(item_id, 1, 'Books', 'good') for item_id in range(1, 2001)]
+    items += [(5000, 2, 'Books', 'good'), (5001, 3, 'Books', 'good')]
+    assignment = app_module.top_trading_cycles(items)
+    assert assignment == {1: 5000, 5000: 1, 2: 5001, 5001: 2}
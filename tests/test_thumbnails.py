@@ -0,0 +1,29 @@
+import io
+
+from PIL import Image
+
+
+def test_thumbnail_evicted_after_lookup_is_regenerated(app_module, client, tmp_path, monkeypatch):
+    local = app_module.LocalStorage(str(tmp_path / 'static'))
+    buf = io.BytesIO()
+    Image.new('RGB', (800, 600), (10, 20, 30)).save(buf, 'JPEG')
+    buf.seek(0)
+    local.put('uploads/ab/cd/photo.jpg', buf)
+    monkeypatch.setattr(app_module, 'storage', local)
+    cache = app_module.DiskLRUCache(str(tmp_path / 'thumbs'), 10 * 1024 * 1024)
+    monkeypatch.setattr(app_module, 'thumbnail_cache', cache)
+
+    assert client.get('/img/uploads/ab/cd/photo.jpg?w=320&fmt=jpeg').status_code == 200
+
+    # Another worker evicts the file between the cache lookup and send_file
+    lookup = cache.get
+
+    def get_then_evict(name):
+        path = lookup(name)
+        (tmp_path / 'thumbs' / name[:2] / name).unlink()
+        return path
+
+    monkeypatch.setattr(cache, 'get', get_then_evict)
+    response = client.get('/img/uploads/ab/cd/photo.jpg?w=320&fmt=jpeg')
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.data)).width == 320
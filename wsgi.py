@@ -1,12 +1,8 @@
-from app import app, scheduler_thread, schedule_weekly_swap_events
-import threading
+from app import app
 
 if __name__ == "__main__":
-    # Start the scheduler thread if not already running
-    if scheduler_thread is None:
-        scheduler_thread = threading.Timer(5, schedule_weekly_swap_events)
-        scheduler_thread.daemon = True
-        scheduler_thread.start()
-        
+    # Scheduled jobs, including the weekly swap events, are started by app.py
+    # in whichever process wins the scheduler lock (see SCHEDULER_MODE)
+
     # Run the app with host binding for external access
-    app.run(host='0.0.0.0', port=5000, use_reloader=False, debug=True) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, use_reloader=False, debug=True)